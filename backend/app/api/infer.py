@@ -1,14 +1,24 @@
+import asyncio
+import time
 import traceback
+from typing import Iterator
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from loguru import logger
 
 from app.types.payload import SearchPayload
-from app.services.agent import extract_locations
+from app.services.agent import extract_locations, stream_locations
 from app.types.schema import LocationData
+from app.types.events import ErrorEvent, LocationEvent
+from app.types.job import Job
+from app.services.jobs import job_manager
 
 router = APIRouter()
 
+JOB_POLL_INTERVAL = 0.5
+MAX_JOB_WAIT = 60
+
 @router.post(path="/venues", response_model=list[LocationData])
 def search_venues(body: SearchPayload) -> list[LocationData]:
     try:
@@ -17,4 +27,61 @@ def search_venues(body: SearchPayload) -> list[LocationData]:
     # the only uncaught exception that should bubble up here is the guardrails intervention
     except BaseException as e:
         logger.error(traceback.format_exc())
-        raise HTTPException(400, repr(e))
\ No newline at end of file
+        raise HTTPException(400, repr(e))
+
+
+class NDJSONResponse(StreamingResponse):
+    media_type = "application/x-ndjson"
+
+
+@router.post(
+    path="/venues/stream", 
+    response_class=NDJSONResponse, 
+    responses={200: {"model": LocationEvent, "description": "A stream of events, one JSON object per line"}},
+)
+def stream_venues(body: SearchPayload) -> NDJSONResponse:
+    """
+    Streams the results as newline-delimited JSON events. A `venue` event is emitted as soon as each location 
+    is enriched, followed by a `caption` event for each of its images. The stream ends with a `done` event, 
+    or an `error` event if the request failed.
+    """
+    def events() -> Iterator[str]:
+        try:
+            for event in stream_locations(body.query, body.num_results, body.num_iterations):
+                yield event.model_dump_json() + "\n"
+        except GeneratorExit:   # the client disconnected
+            raise
+        except BaseException as e:
+            logger.error(traceback.format_exc())
+            yield ErrorEvent(detail=repr(e)).model_dump_json() + "\n"
+
+    return NDJSONResponse(events())
+
+
+@router.post(path="/jobs", response_model=Job, status_code=202)
+def submit_job(body: SearchPayload) -> Job:
+    """
+    Queue a search request to be processed by a background worker, and return immediately. Use 
+    `GET /infer/jobs/{job_id}` to retrieve the progress and results of the job.
+    """
+    return job_manager.submit(body)
+
+
+@router.get(path="/jobs/{job_id}", response_model=Job)
+async def get_job(
+    job_id: str, 
+    wait: float = Query(0, ge=0, le=MAX_JOB_WAIT, description="Seconds to wait for the job to change before responding"),
+    version: int = Query(-1, description="Respond as soon as the job version is greater than this value"),
+) -> Job:
+    """
+    Retrieve the status, partial results and final results of a job. Set `wait` to long-poll: the response is 
+    held until the job version is greater than `version`, the job finishes, or `wait` seconds have passed.
+    """
+    deadline = time.monotonic() + wait
+    while True:
+        job = await asyncio.to_thread(job_manager.store.get, job_id)
+        if job is None:
+            raise HTTPException(404, f"Job {job_id} not found")
+        if job.version > version or job.status in ("succeeded", "failed") or time.monotonic() >= deadline:
+            return job
+        await asyncio.sleep(JOB_POLL_INTERVAL)
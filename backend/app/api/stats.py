@@ -0,0 +1,60 @@
+from fastapi import APIRouter
+
+from app.core.singleflight import single_flight_stats as get_single_flight_stats
+from app.dependencies.browser import browser_pool
+from app.dependencies.guardrail import guardrail_stats as get_guardrail_stats, verdict_cache
+from app.dependencies.llm import llm_cache, llm_stats as get_llm_stats
+from app.services.tools.scraper import fetch_tier_cache, scrape_cache, scraper_stats as get_scraper_stats
+from app.services.tools.search import search_cache
+from app.types.stats import BrowserPoolStats, CacheStats, GuardrailStats, LLMStats, ScraperStats, SingleFlightStats
+
+router = APIRouter()
+
+@router.get(path="/browser", response_model=BrowserPoolStats)
+def browser_stats() -> BrowserPoolStats:
+    return browser_pool.stats()
+
+
+@router.get(path="/scraper", response_model=ScraperStats)
+def scraper_stats() -> ScraperStats:
+    return get_scraper_stats()
+
+
+@router.get(path="/fetch-tier-cache", response_model=CacheStats)
+def fetch_tier_cache_stats() -> CacheStats:
+    return fetch_tier_cache.stats()
+
+
+@router.get(path="/scrape-cache", response_model=CacheStats)
+def scrape_cache_stats() -> CacheStats:
+    return scrape_cache.stats()
+
+
+@router.get(path="/search-cache", response_model=CacheStats)
+def search_cache_stats() -> CacheStats:
+    return search_cache.stats()
+
+
+@router.get(path="/llm-cache", response_model=CacheStats)
+def llm_cache_stats() -> CacheStats:
+    return llm_cache.stats()
+
+
+@router.get(path="/llm", response_model=LLMStats)
+def llm_stats() -> LLMStats:
+    return get_llm_stats()
+
+
+@router.get(path="/guardrail", response_model=GuardrailStats)
+def guardrail_stats() -> GuardrailStats:
+    return get_guardrail_stats()
+
+
+@router.get(path="/guardrail-cache", response_model=CacheStats)
+def guardrail_cache_stats() -> CacheStats:
+    return verdict_cache.stats()
+
+
+@router.get(path="/single-flight", response_model=list[SingleFlightStats])
+def single_flight_stats() -> list[SingleFlightStats]:
+    return get_single_flight_stats()
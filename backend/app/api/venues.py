@@ -0,0 +1,43 @@
+from fastapi import APIRouter, HTTPException, Query, Response
+
+from app.services.venues import VENUE_FIELDS, venue_store
+from app.types.venue import StoredVenue
+
+router = APIRouter()
+
+@router.get(path="", response_model=list[StoredVenue])
+def list_venues() -> list[StoredVenue]:
+    return venue_store.entries()
+
+
+@router.get(path="/{key}", response_model=StoredVenue)
+def get_venue(key: str) -> StoredVenue:
+    venue = venue_store.get_by_key(key)
+    if venue is None:
+        raise HTTPException(404, f"Venue {key} not found")
+    return venue
+
+
+@router.delete(path="/{key}", status_code=204)
+def invalidate_venue(
+    key: str,
+    fields: list[str] | None = Query(None, description="Fields to mark as stale. The venue is removed if omitted."),
+) -> Response:
+    """
+    Mark some fields of a stored venue as stale, so that they are enriched again by the next request for
+    the venue, or remove the venue entirely.
+    """
+    unknown = set(fields or []) - set(VENUE_FIELDS)
+    if unknown:
+        raise HTTPException(400, f"Unknown field(s) {sorted(unknown)}, expected any of {VENUE_FIELDS}")
+    if not venue_store.invalidate(key, fields):
+        raise HTTPException(404, f"Venue {key} not found")
+    return Response(status_code=204)
+
+
+@router.delete(path="", response_model=int)
+def clear_venues() -> int:
+    """
+    Remove every stored venue, returning the number of venues removed.
+    """
+    return venue_store.clear()
@@ -0,0 +1,8 @@
+import threading
+
+from app.core.config import settings
+
+# Process-wide limits on the number of concurrent calls made to each external dependency.
+# The browser is bounded by the size of the browser pool instead.
+search_limiter = threading.BoundedSemaphore(settings.SEARCH_CONCURRENCY)
+bedrock_limiter = threading.BoundedSemaphore(settings.BEDROCK_CONCURRENCY)
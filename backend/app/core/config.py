@@ -1,15 +1,79 @@
-from typing import Optional
+from typing import Literal, Optional
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings
 from dotenv import load_dotenv
 
 load_dotenv()
 
+class RateLimit(BaseModel):
+    requests_per_second: float
+    tokens_per_minute: float
+
 class Settings(BaseSettings):
     ENV: str = "debug"
+    DATA_DIR: str = "data"
     BEDROCK_LLM_ID: str
     BEDROCK_MULTIMODAL_ID: str
     BEDROCK_USE_GUARDRAIL: bool
     BEDROCK_GUARDRAIL_ID: Optional[str] = None
     BEDROCK_GUARDRAIL_VERSION: Optional[str] = None
+    BEDROCK_GUARDRAIL_OPTIMISTIC: bool = False
+    # rate limits per Bedrock model id, e.g. '{"amazon.nova-lite-v1:0": {"requests_per_second": 2, "tokens_per_minute": 200000}}'
+    BEDROCK_RATE_LIMITS: dict[str, RateLimit] = {}
+    BEDROCK_DEFAULT_RATE_LIMIT: RateLimit = RateLimit(requests_per_second=2, tokens_per_minute=300000)
+    BROWSER_POOL_SIZE: int = 4
+    BROWSER_CONTEXT_MAX_USES: int = 20
+    BROWSER_BLOCK_RESOURCES: bool = True
+    SCRAPE_CONCURRENCY: int = 4
+    ENRICHMENT_CONCURRENCY: int = 4
+    # the enrichment of a location stops early once this fraction of its fields is filled
+    ENRICHMENT_COMPLETENESS_THRESHOLD: float = 1.0
+    # the number of locations extracted from a page in a single LLM call, which is limited by how many 
+    # complete locations fit in the `max_tokens` of the text LLM (1024)
+    BATCH_EXTRACTION_SIZE: int = 2
+    # candidate names whose character trigrams are at least this similar (Dice coefficient) are the same venue
+    CANDIDATE_SIMILARITY_THRESHOLD: float = 0.8
+    SEARCH_CONCURRENCY: int = 2
+    BEDROCK_CONCURRENCY: int = 4
+    CAPTION_CONCURRENCY: int = 4
+    # token budget of the page content given to the LLM, counted with a tiktoken encoding
+    PAGE_CONTENT_MAX_TOKENS: int = 2500
+    PAGE_CONTENT_ENCODING: str = "cl100k_base"
+    SCRAPE_CACHE_BACKEND: Literal["memory", "sqlite"] = "sqlite"
+    SCRAPE_CACHE_TTL: int = 24 * 60 * 60
+    SCRAPE_CACHE_MAX_SIZE: int = 256 * 1024 * 1024
+    # pages are downloaded without a browser first, and rendered if they have less text than this
+    SCRAPE_HTTP_FIRST: bool = True
+    SCRAPE_MIN_TEXT_LENGTH: int = 500
+    SCRAPE_MIN_TEXT_DENSITY: float = 0.005
+    HTTP_POOL_SIZE: int = 16
+    FETCH_TIER_CACHE_BACKEND: Literal["memory", "sqlite"] = "sqlite"
+    FETCH_TIER_CACHE_TTL: int = 7 * 24 * 60 * 60
+    FETCH_TIER_CACHE_MAX_SIZE: int = 1024 * 1024
+    SEARCH_CACHE_BACKEND: Literal["memory", "sqlite"] = "memory"
+    SEARCH_CACHE_TTL: int = 6 * 60 * 60
+    SEARCH_CACHE_MAX_SIZE: int = 16 * 1024 * 1024
+    LLM_CACHE_BACKEND: Literal["memory", "sqlite"] = "sqlite"
+    LLM_CACHE_TTL: int = 7 * 24 * 60 * 60
+    LLM_CACHE_MAX_SIZE: int = 64 * 1024 * 1024
+    # stream completions of the text LLM and stop as soon as the JSON value in them is complete
+    LLM_STREAM_JSON: bool = True
+    # enriched venues are stored and served again until their fields go stale
+    VENUE_STORE_ENABLED: bool = True
+    VENUE_STORE_TTLS: dict[str, int] = {
+        "address": 180 * 24 * 60 * 60,
+        "contact": 90 * 24 * 60 * 60,
+        "opening_hours": 7 * 24 * 60 * 60,
+        "description": 180 * 24 * 60 * 60,
+        "offerings": 30 * 24 * 60 * 60,
+        "images": 90 * 24 * 60 * 60,
+    }
+    GUARDRAIL_CACHE_BACKEND: Literal["memory", "sqlite"] = "sqlite"
+    GUARDRAIL_CACHE_TTL: int = 7 * 24 * 60 * 60
+    GUARDRAIL_CACHE_MAX_SIZE: int = 16 * 1024 * 1024
+    JOB_WORKERS: int = 2
+    JOB_RETENTION: int = 7 * 24 * 60 * 60
+    # a job is resumed by another process if the process running it did not renew its lease for this long
+    JOB_LEASE: int = 60
 
 settings = Settings()
\ No newline at end of file
@@ -0,0 +1,79 @@
+JSON_FENCE = "```json"
+
+
+class JsonValueDetector:
+    """
+    Detects the end of the first JSON object or list in text that arrives in chunks, e.g. a streamed LLM
+    completion, examining each character once. A value is only recognised at the start of the text or
+    right after a ```json fence, so that brackets in commentary before the value are not mistaken for it.
+    The value also ends at a closing fence, in which case it is incomplete.
+    """
+    def __init__(self):
+        self.started = False
+        self.done = False
+        self.complete = False   # whether the value was closed, rather than cut off by a closing fence
+        self._prose = False     # waiting for a fence after text that is not JSON
+        self._tail = ""         # the end of the previous chunk, in case a fence is split across chunks
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, chunk: str) -> bool:
+        """
+        Examine the next chunk of text.
+
+        :param str chunk: The next chunk of text
+        :return bool: Whether the value has ended, in which case the rest of the text is not needed
+        """
+        i = 0
+        while i < len(chunk) and not self.done:
+            if self._prose:
+                text = self._tail + chunk[i:]
+                position = text.find(JSON_FENCE)
+                if position == -1:
+                    self._tail = text[-(len(JSON_FENCE) - 1):]
+                    return False
+                i += position + len(JSON_FENCE) - len(self._tail)
+                self._tail = ""
+                self._prose = False
+                continue
+
+            c = chunk[i]
+            if not self.started:
+                if c in "{[":
+                    self.started = True
+                    self._depth = 1
+                elif not c.isspace():
+                    self._prose = True
+                    continue
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+            elif c == '"':
+                self._in_string = True
+            elif c in "{[":
+                self._depth += 1
+            elif c in "}]":
+                self._depth -= 1
+                self.done = self.complete = self._depth == 0
+            elif c == "`":
+                self.done = True
+            i += 1
+        return self.done
+
+
+def is_complete_json(text: str) -> bool:
+    """
+    Whether the first JSON object or list in a completion is closed, i.e. the completion was not cut off 
+    (e.g. at `max_tokens`) before the end of the value.
+
+    :param str text: The completion
+    :return bool: Whether the value is complete
+    """
+    detector = JsonValueDetector()
+    detector.feed(text)
+    return detector.complete
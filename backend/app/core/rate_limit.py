@@ -0,0 +1,109 @@
+import asyncio
+import threading
+import time
+
+from loguru import logger
+
+from app.core.config import settings
+
+THROTTLE_DECREASE = 0.5     # the rate is halved whenever Bedrock throttles a request
+RECOVERY_INCREASE = 0.05    # and recovers by 5% of the configured rate after every successful request
+MIN_RATE_FRACTION = 0.05    # the rate never drops below 5% of the configured rate
+
+
+class _Bucket:
+    """
+    A token bucket that is allowed to go into debt. Each reservation is deducted immediately, and the caller
+    waits until the bucket would have refilled to zero. Since reservations are made one at a time, callers
+    are served in the order they arrived.
+    """
+    def __init__(self, rate: float, capacity: float):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def reserve(self, amount: float, now: float) -> float:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        self.tokens -= min(amount, self.capacity)
+        return max(0.0, -self.tokens / self.rate)
+
+    def scale(self, factor: float) -> None:
+        self.rate = min(self.max_rate, max(self.max_rate * MIN_RATE_FRACTION, self.rate * factor))
+
+
+class RateLimiter:
+    """
+    A process-wide rate limiter of a single Bedrock model, enforcing both a request rate and a token rate.
+    Throttling feedback from Bedrock lowers both rates, which then recover gradually as requests succeed.
+    """
+    def __init__(self, model_id: str, requests_per_second: float, tokens_per_minute: float):
+        self.model_id = model_id
+        self._requests = _Bucket(requests_per_second, max(1.0, requests_per_second))
+        self._tokens = _Bucket(tokens_per_minute / 60, tokens_per_minute / 60)
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int) -> None:
+        """
+        Block until a request using the estimated number of tokens may be sent.
+
+        :param int tokens: The estimated number of input and output tokens of the request
+        """
+        time.sleep(self._reserve(tokens))
+
+    async def acquire_async(self, tokens: int) -> None:
+        """
+        Asynchronous version of `acquire`.
+
+        :param int tokens: The estimated number of input and output tokens of the request
+        """
+        await asyncio.sleep(self._reserve(tokens))
+
+    def on_success(self) -> None:
+        """
+        Record a successful request, letting the rates recover towards their configured values.
+        """
+        with self._lock:
+            for bucket in (self._requests, self._tokens):
+                bucket.rate = min(bucket.max_rate, bucket.rate + bucket.max_rate * RECOVERY_INCREASE)
+
+    def on_throttle(self) -> None:
+        """
+        Record a `ThrottlingException`, lowering the rates and draining the request bucket.
+        """
+        with self._lock:
+            for bucket in (self._requests, self._tokens):
+                bucket.scale(THROTTLE_DECREASE)
+            self._requests.tokens = min(self._requests.tokens, 0.0)
+            logger.debug(f"Throttled by Bedrock, lowered the request rate of {self.model_id} to {self._requests.rate:.2f}/s")
+
+    def _reserve(self, tokens: int) -> float:
+        with self._lock:
+            now = time.monotonic()
+            return max(self._requests.reserve(1, now), self._tokens.reserve(tokens, now))
+
+
+_limiters: dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(model_id: str) -> RateLimiter:
+    """
+    Return the process-wide rate limiter of a Bedrock model, configured by `settings.BEDROCK_RATE_LIMITS`.
+
+    :param str model_id: The Bedrock model id
+    :return RateLimiter: The shared rate limiter of the model
+    """
+    with _limiters_lock:
+        if model_id not in _limiters:
+            limit = settings.BEDROCK_RATE_LIMITS.get(model_id, settings.BEDROCK_DEFAULT_RATE_LIMIT)
+            _limiters[model_id] = RateLimiter(model_id, limit.requests_per_second, limit.tokens_per_minute)
+        return _limiters[model_id]
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Roughly estimate the number of tokens in a piece of text.
+    """
+    return len(text) // 4 + 1
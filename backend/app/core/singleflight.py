@@ -0,0 +1,163 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Hashable
+
+from app.types.stats import SingleFlightStats
+
+
+class _Call:
+    """
+    An in-flight call whose result is shared by every caller of the same key.
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+        # the futures of the asynchronous callers waiting for the call, on their own event loops, which is 
+        # None once the call has finished
+        self.waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] | None = []
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into a single execution. The first caller runs the
+    function, and callers that arrive while it is running wait for and share its result (or exception).
+    Synchronous and asynchronous callers of the same key share the same execution. If the caller running
+    the function is cancelled, the waiting callers run it again instead of sharing the cancellation.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self._executions = 0
+        self._coalesced = 0
+        with _registry_lock:
+            _registry.append(self)
+
+    def do(self, key: Hashable, function: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Run `function(*args, **kwargs)` unless a call with the same key is already running, in which case
+        wait for that call to finish and return its result instead.
+
+        :param Hashable key: The key identifying identical calls
+        :param Callable function: The function to run
+        :return Any: The return value of the function
+        """
+        while True:
+            call, leader = self._join(key)
+            if leader:
+                break
+            call.done.wait()
+            if not isinstance(call.error, asyncio.CancelledError):
+                return self._share(call)
+
+        try:
+            call.result = function(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise e
+        finally:
+            self._leave(key, call)
+        return call.result
+
+    async def do_async(self, key: Hashable, function: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """
+        Asynchronous version of `do`, running the coroutine function `function(*args, **kwargs)`. Waiting
+        for a call that is already running does not block the event loop, nor take up a thread.
+
+        :param Hashable key: The key identifying identical calls
+        :param Callable function: The coroutine function to run
+        :return Any: The return value of the function
+        """
+        while True:
+            call, leader = self._join(key)
+            if leader:
+                break
+            waiter = self._waiter(call)
+            if waiter is not None:
+                await waiter
+            if not isinstance(call.error, asyncio.CancelledError):
+                return self._share(call)
+
+        try:
+            call.result = await function(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise e
+        finally:
+            self._leave(key, call)
+        return call.result
+
+    def stats(self) -> SingleFlightStats:
+        """
+        Return a snapshot of how many calls were coalesced.
+        """
+        with self._lock:
+            calls = self._executions + self._coalesced
+            return SingleFlightStats(
+                name=self.name,
+                in_flight=len(self._calls),
+                executions=self._executions,
+                coalesced=self._coalesced,
+                coalesced_rate=self._coalesced / calls if calls else 0.0,
+            )
+
+    def _join(self, key: Hashable) -> tuple[_Call, bool]:
+        """
+        Return the in-flight call of the key, starting a new one if there is none, and whether the caller
+        has to run it.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._executions += 1
+            else:
+                self._coalesced += 1
+        return call, leader
+
+    def _waiter(self, call: _Call) -> asyncio.Future | None:
+        """
+        Return a future of the running event loop that is resolved once the call has finished, or None if
+        it has already finished.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if call.waiters is None:
+                return None
+            waiter = loop.create_future()
+            call.waiters.append((loop, waiter))
+        return waiter
+
+    def _leave(self, key: Hashable, call: _Call) -> None:
+        with self._lock:
+            del self._calls[key]
+            waiters, call.waiters = call.waiters, None
+        call.done.set()
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(_resolve, waiter)
+            except RuntimeError:    # the event loop of the waiter was closed
+                pass
+
+    def _share(self, call: _Call) -> Any:
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+def _resolve(waiter: asyncio.Future) -> None:
+    if not waiter.done():   # the waiter may have been cancelled
+        waiter.set_result(None)
+
+
+_registry: list[SingleFlight] = []
+_registry_lock = threading.Lock()
+
+def single_flight_stats() -> list[SingleFlightStats]:
+    """
+    Return a snapshot of the statistics of every single-flight group in the process.
+    """
+    with _registry_lock:
+        return [flight.stats() for flight in _registry]
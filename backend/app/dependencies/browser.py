@@ -0,0 +1,313 @@
+import asyncio
+import threading
+import time
+from dataclasses import dataclass
+from urllib.parse import urlsplit
+
+from loguru import logger
+from playwright.async_api import async_playwright, Browser, BrowserContext, Page, Playwright, Route
+
+from app.core.config import settings
+from app.types.stats import BrowserPoolStats
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3"
+NAVIGATION_TIMEOUT = 10000  # we wait at most 10 seconds for the html of a page to load
+STARTUP_TIMEOUT = 60
+
+# once the html is loaded, the page is ready when the length of its text stops changing
+READY_POLL_INTERVAL = 0.25
+READY_STABLE_POLLS = 2
+DEFAULT_READY_TIMEOUT = 3.0     # the time given to pages of an unknown domain to render
+MIN_READY_TIMEOUT = 1.0
+MAX_READY_TIMEOUT = 10.0
+READY_TIMEOUT_MARGIN = 2.0      # pages of a known domain get twice the time they usually need
+READY_TIME_SMOOTHING = 0.3
+TEXT_LENGTH_SCRIPT = "document.body ? document.body.innerText.length : 0"
+
+# resources that are not needed to extract the text of a page. Images are not downloaded, but the `src` 
+# attributes of image elements are still part of the html.
+BLOCKED_RESOURCE_TYPES = {"image", "media", "font", "stylesheet"}
+BLOCKED_HOSTS = (
+    "doubleclick.net", "googlesyndication.com", "googleadservices.com", "google-analytics.com", 
+    "googletagmanager.com", "googletagservices.com", "adservice.google.com", "amazon-adsystem.com", 
+    "adnxs.com", "criteo.com", "criteo.net", "taboola.com", "outbrain.com", "scorecardresearch.com", 
+    "quantserve.com", "hotjar.com", "facebook.net", "connect.facebook.net", "analytics.tiktok.com", 
+    "ads-twitter.com", "clarity.ms", "newrelic.com", "nr-data.net", "segment.io", "mixpanel.com", 
+    "pubmatic.com", "rubiconproject.com", "openx.net", "casalemedia.com", "moatads.com", "chartbeat.com",
+)
+
+
+@dataclass
+class _ContextSlot:
+    """
+    A single browser context owned by the pool, along with its bookkeeping.
+    """
+    context: BrowserContext | None = None
+    uses: int = 0
+    crashed: bool = False
+    generation: int = 0     # the browser launch this context belongs to
+
+
+class _ReadyTimeouts:
+    """
+    Learns how long the pages of each domain take to render, so that fast domains are not waited on
+    for long and slow domains get more time.
+    """
+    def __init__(self):
+        self._ready_times: dict[str, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._ready_times)
+
+    def timeout(self, domain: str) -> float:
+        ready_time = self._ready_times.get(domain)
+        if ready_time is None:
+            return DEFAULT_READY_TIMEOUT
+        return min(MAX_READY_TIMEOUT, max(MIN_READY_TIMEOUT, ready_time * READY_TIMEOUT_MARGIN))
+
+    def record(self, domain: str, elapsed: float, ready: bool) -> None:
+        """
+        Record the time a page took to become ready. Pages that were not ready in time count as 
+        taking longer, so that the timeout of their domain grows.
+        """
+        if not ready:
+            elapsed *= READY_TIMEOUT_MARGIN
+        previous = self._ready_times.get(domain)
+        if previous is None:
+            self._ready_times[domain] = elapsed
+        else:
+            self._ready_times[domain] = previous + READY_TIME_SMOOTHING * (elapsed - previous)
+
+
+class BrowserPool:
+    """
+    A long-lived pool of headless Chromium contexts. A single browser is launched on a dedicated event
+    loop thread and each fetch borrows one isolated browser context from the pool. Contexts are recycled
+    after a configurable number of uses, or as soon as they crash. Heavy resources and ad or analytics 
+    hosts are blocked, and pages are read as soon as their text stops changing.
+    """
+    def __init__(self, size: int, max_uses: int):
+        self.size = size
+        self.max_uses = max_uses
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._playwright: Playwright | None = None
+        self._browser: Browser | None = None
+        self._slots: asyncio.Queue[_ContextSlot] | None = None
+        self._lock = threading.Lock()
+        self._ready_timeouts = _ReadyTimeouts()
+        # statistics
+        self._in_use = 0
+        self._total_fetches = 0
+        self._failed_fetches = 0
+        self._contexts_recycled = 0
+        self._browser_restarts = 0
+        self._blocked_requests = 0
+        self._ready_timeouts_hit = 0
+
+    @property
+    def started(self) -> bool:
+        return self._loop is not None and self._loop.is_running()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """
+        The event loop that owns the browser. Starts the pool if it is not running yet.
+        """
+        if not self.started:
+            self.start()
+        return self._loop
+
+    def start(self) -> None:
+        """
+        Launch the browser on a background event loop thread. Calling this more than once is a no-op.
+        """
+        with self._lock:
+            if self.started:
+                return
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="browser-pool", daemon=True)
+            thread.start()
+            try:
+                asyncio.run_coroutine_threadsafe(self._start(), loop).result(STARTUP_TIMEOUT)
+            except BaseException as e:
+                loop.call_soon_threadsafe(loop.stop)
+                thread.join()
+                loop.close()
+                raise e
+            self._loop, self._thread = loop, thread
+            logger.info(f"Browser pool started with {self.size} contexts")
+
+    def stop(self) -> None:
+        """
+        Close every context, the browser and the background event loop.
+        """
+        with self._lock:
+            if not self.started:
+                return
+            try:
+                asyncio.run_coroutine_threadsafe(self._stop(), self._loop).result(STARTUP_TIMEOUT)
+            except Exception as e:
+                logger.error(f"Error shutting down browser pool: {e}")
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop, self._thread = None, None
+            logger.info("Browser pool stopped")
+
+    def fetch(self, url: str) -> str:
+        """
+        Render a page with a pooled browser context and return its HTML. Blocks the calling thread.
+
+        :param str url: The URL of the web page
+        :return str: The rendered HTML, or an empty string if nothing could be retrieved
+        """
+        return asyncio.run_coroutine_threadsafe(self.fetch_async(url), self.loop).result()
+
+    async def fetch_async(self, url: str) -> str:
+        """
+        Render a page with a pooled browser context and return its HTML. Must be awaited on the pool's
+        event loop.
+
+        :param str url: The URL of the web page
+        :return str: The rendered HTML, or an empty string if nothing could be retrieved
+        """
+        slot = await self._acquire()
+        self._in_use += 1
+        self._total_fetches += 1
+        content = ""
+        try:
+            page = await slot.context.new_page()
+            try:
+                try:
+                    await page.goto(url, wait_until="domcontentloaded", timeout=NAVIGATION_TIMEOUT)
+                    await self._wait_until_ready(page, urlsplit(url).hostname or "")
+                except Exception as e:
+                    logger.error(f"Error loading page: {e}")
+                try:    # attempts to retrieve page contents regardless
+                    content = await page.content()
+                except Exception as e:
+                    logger.error(f"Error retrieving page content: {e}")
+            finally:
+                await page.close()
+        except Exception as e:
+            # the context (or the whole browser) is no longer usable, so it is replaced on next use
+            logger.error(f"Browser context crashed while loading {url}: {e}")
+            slot.crashed = True
+        finally:
+            if not content:
+                self._failed_fetches += 1
+            self._in_use -= 1
+            self._slots.put_nowait(slot)
+        return content
+
+    def stats(self) -> BrowserPoolStats:
+        """
+        Return a snapshot of the pool statistics.
+        """
+        return BrowserPoolStats(
+            started=self.started,
+            size=self.size,
+            max_uses=self.max_uses,
+            in_use=self._in_use,
+            idle=self._slots.qsize() if self._slots else 0,
+            total_fetches=self._total_fetches,
+            failed_fetches=self._failed_fetches,
+            contexts_recycled=self._contexts_recycled,
+            browser_restarts=self._browser_restarts,
+            blocked_requests=self._blocked_requests,
+            ready_timeouts=self._ready_timeouts_hit,
+            learned_domains=len(self._ready_timeouts),
+        )
+
+    async def _wait_until_ready(self, page: Page, domain: str) -> None:
+        """
+        Poll the length of the text of a loaded page until it is the same for a few polls in a row, or 
+        until the learned timeout of the domain runs out.
+        """
+        start = time.monotonic()
+        deadline = start + self._ready_timeouts.timeout(domain)
+        previous_length, stable_polls = -1, 0
+        while True:
+            length = await page.evaluate(TEXT_LENGTH_SCRIPT)
+            stable_polls = stable_polls + 1 if length and length == previous_length else 0
+            previous_length = length
+            if stable_polls >= READY_STABLE_POLLS:
+                self._ready_timeouts.record(domain, time.monotonic() - start, True)
+                return
+            if time.monotonic() >= deadline:
+                self._ready_timeouts_hit += 1
+                self._ready_timeouts.record(domain, time.monotonic() - start, False)
+                logger.debug(f"Page of {domain} was still changing after {time.monotonic() - start:.1f}s")
+                return
+            await asyncio.sleep(READY_POLL_INTERVAL)
+
+    async def _route(self, route: Route) -> None:
+        """
+        Abort requests of blocked resource types or hosts, and let the others through.
+        """
+        request = route.request
+        host = urlsplit(request.url).hostname or ""
+        try:
+            if request.resource_type in BLOCKED_RESOURCE_TYPES or _is_blocked_host(host):
+                self._blocked_requests += 1
+                await route.abort()
+            else:
+                await route.continue_()
+        except Exception as e:  # the page was closed while the request was pending
+            logger.trace(f"Failed to route {request.url}: {e}")
+
+    async def _start(self) -> None:
+        self._playwright = await async_playwright().start()
+        await self._launch_browser()
+        self._slots = asyncio.Queue()
+        for _ in range(self.size):
+            self._slots.put_nowait(_ContextSlot())
+
+    async def _stop(self) -> None:
+        if self._browser:
+            await self._browser.close()
+        if self._playwright:
+            await self._playwright.stop()
+        self._browser, self._playwright, self._slots = None, None, None
+
+    async def _launch_browser(self) -> None:
+        self._browser = await self._playwright.chromium.launch(headless=True)
+
+    async def _acquire(self) -> _ContextSlot:
+        """
+        Borrow a context from the pool, recreating it if it is exhausted, crashed or was never created.
+        """
+        slot = await self._slots.get()
+        try:
+            if not self._browser.is_connected():
+                logger.warning("Browser disconnected, relaunching")
+                self._browser_restarts += 1
+                await self._launch_browser()
+            if slot.generation != self._browser_restarts:
+                slot.context = None     # contexts of a dead browser cannot be closed or reused
+            if slot.context and (slot.crashed or slot.uses >= self.max_uses):
+                self._contexts_recycled += 1
+                try:
+                    await slot.context.close()
+                except Exception as e:
+                    logger.warning(f"Failed to close browser context: {e}")
+                slot.context = None
+            if slot.context is None:
+                slot.context = await self._browser.new_context(user_agent=USER_AGENT)
+                if settings.BROWSER_BLOCK_RESOURCES:
+                    await slot.context.route("**/*", self._route)
+                slot.uses, slot.crashed, slot.generation = 0, False, self._browser_restarts
+        except BaseException as e:
+            slot.crashed = True
+            self._slots.put_nowait(slot)
+            raise e
+        slot.uses += 1
+        return slot
+
+
+def _is_blocked_host(host: str) -> bool:
+    return any(host == blocked or host.endswith("." + blocked) for blocked in BLOCKED_HOSTS)
+
+
+browser_pool = BrowserPool(settings.BROWSER_POOL_SIZE, settings.BROWSER_CONTEXT_MAX_USES)
@@ -0,0 +1,224 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Literal
+
+from loguru import logger
+
+from app.core.config import settings
+from app.types.stats import CacheStats
+
+
+class Cache:
+    """
+    Base class of the key-value caches. Values are strings that expire after a time-to-live, and the least
+    recently used entries are evicted once the total size of the stored values exceeds `max_size` bytes.
+    """
+    def __init__(self, name: str, ttl: float, max_size: int):
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key: str) -> str | None:
+        """
+        Retrieve a value from the cache.
+
+        :param str key: The cache key
+        :return str | None: The cached value, or None if the key is missing or has expired
+        """
+        with self._lock:
+            value = self._get(key, time.time())
+            if value is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+            return value
+
+    def set(self, key: str, value: str, ttl: float | None = None) -> None:
+        """
+        Store a value in the cache, evicting the least recently used entries if the cache is full.
+
+        :param str key: The cache key
+        :param str value: The value to be cached
+        :param float | None ttl: An optional time-to-live in seconds that overrides the default of the cache
+        """
+        size = len(value.encode())
+        if size > self.max_size:
+            return
+        with self._lock:
+            self._evictions += self._set(key, value, size, time.time() + (ttl if ttl is not None else self.ttl))
+
+    def delete(self, key: str) -> None:
+        """
+        Remove a single entry from the cache.
+        """
+        with self._lock:
+            self._delete(key)
+
+    def clear(self) -> None:
+        """
+        Remove every entry from the cache.
+        """
+        with self._lock:
+            self._clear()
+
+    def stats(self) -> CacheStats:
+        """
+        Return a snapshot of the cache statistics.
+        """
+        with self._lock:
+            entries, size = self._usage()
+        lookups = self._hits + self._misses
+        return CacheStats(
+            name=self.name,
+            entries=entries,
+            size=size,
+            max_size=self.max_size,
+            ttl=self.ttl,
+            hits=self._hits,
+            misses=self._misses,
+            hit_rate=self._hits / lookups if lookups else 0.0,
+            evictions=self._evictions,
+        )
+
+    def _get(self, key: str, now: float) -> str | None: ...
+
+    def _set(self, key: str, value: str, size: int, expires_at: float) -> int: ...
+
+    def _delete(self, key: str) -> None: ...
+
+    def _clear(self) -> None: ...
+
+    def _usage(self) -> tuple[int, int]: ...
+
+
+class MemoryCache(Cache):
+    """
+    An in-process cache. Entries do not survive restarts.
+    """
+    def __init__(self, name: str, ttl: float, max_size: int):
+        super().__init__(name, ttl, max_size)
+        self._entries: OrderedDict[str, tuple[str, int, float]] = OrderedDict()
+        self._size = 0
+
+    def _get(self, key: str, now: float) -> str | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, _, expires_at = entry
+        if expires_at <= now:
+            self._delete(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _set(self, key: str, value: str, size: int, expires_at: float) -> int:
+        self._delete(key)
+        self._entries[key] = (value, size, expires_at)
+        self._size += size
+        evicted = 0
+        while self._size > self.max_size:
+            _, (_, old_size, _) = self._entries.popitem(last=False)
+            self._size -= old_size
+            evicted += 1
+        return evicted
+
+    def _delete(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[1]
+
+    def _clear(self) -> None:
+        self._entries.clear()
+        self._size = 0
+
+    def _usage(self) -> tuple[int, int]:
+        return len(self._entries), self._size
+
+
+class SQLiteCache(Cache):
+    """
+    A cache persisted in a local SQLite database, so that entries survive restarts.
+    """
+    def __init__(self, name: str, ttl: float, max_size: int, path: str):
+        super().__init__(name, ttl, max_size)
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)")
+        self._connection.execute("DELETE FROM entries WHERE expires_at <= ?", (time.time(),))
+
+    def _get(self, key: str, now: float) -> str | None:
+        row = self._connection.execute("SELECT value, expires_at FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at <= now:
+            self._delete(key)
+            return None
+        self._connection.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+        return value
+
+    def _set(self, key: str, value: str, size: int, expires_at: float) -> int:
+        now = time.time()
+        with self._connection:
+            self._connection.execute("BEGIN")
+            self._connection.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, expires_at, now)
+            )
+            # expired entries are dropped first, followed by the least recently used ones
+            evicted = self._connection.execute("DELETE FROM entries WHERE expires_at <= ?", (now,)).rowcount
+            total = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total > self.max_size:
+                rows = self._connection.execute("SELECT key, size FROM entries ORDER BY accessed_at").fetchall()
+                stale = []
+                for old_key, old_size in rows:
+                    if total <= self.max_size:
+                        break
+                    stale.append((old_key,))
+                    total -= old_size
+                self._connection.executemany("DELETE FROM entries WHERE key = ?", stale)
+                evicted += len(stale)
+        return evicted
+
+    def _delete(self, key: str) -> None:
+        self._connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def _clear(self) -> None:
+        self._connection.execute("DELETE FROM entries")
+
+    def _usage(self) -> tuple[int, int]:
+        return self._connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+
+
+def create_cache(name: str, backend: Literal["memory", "sqlite"], ttl: float, max_size: int) -> Cache:
+    """
+    Create a cache with the configured backend. SQLite databases are stored in `settings.DATA_DIR`.
+
+    :param str name: The name of the cache, which is also used as the name of the database file
+    :param str backend: Either `memory` or `sqlite`
+    :param float ttl: The default time-to-live of each entry in seconds
+    :param int max_size: The maximum total size of the cached values in bytes
+    :return Cache: The cache
+    """
+    if backend == "sqlite":
+        path = os.path.join(settings.DATA_DIR, f"{name}.sqlite3")
+        try:
+            return SQLiteCache(name, ttl, max_size, path)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to open {path}, falling back to an in-memory cache: {e}")
+    return MemoryCache(name, ttl, max_size)
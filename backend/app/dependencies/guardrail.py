@@ -1,35 +1,106 @@
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
 import boto3
 from loguru import logger
 
 from app.core.config import settings
+from app.dependencies.cache import create_cache
+from app.types.stats import GuardrailStats
 
 class GuardrailException(BaseException): ...
 
 guardrail_client = boto3.client("bedrock-runtime")
 
+verdict_cache = create_cache(
+    "guardrail_cache", settings.GUARDRAIL_CACHE_BACKEND, settings.GUARDRAIL_CACHE_TTL, settings.GUARDRAIL_CACHE_MAX_SIZE
+)
+
+# runs the input checks of optimistic mode alongside generation
+guardrail_executor = ThreadPoolExecutor(max_workers=settings.BEDROCK_CONCURRENCY, thread_name_prefix="guardrail")
+
+_stats_lock = threading.Lock()
+_calls = 0
+_cache_hits = 0
+_interventions = 0
+_latency = 0.0
+
 def apply_guardrail(text: str, is_input: bool = True) -> None:
     """
-    Apply guardrail on a piece of text. Raises a `GuardrailException` if 
-    the guardrail intervened.
+    Apply guardrail on a piece of text. Raises a `GuardrailException` if
+    the guardrail intervened. Verdicts are cached, so the same text is only
+    sent to the guardrail once.
 
     :param str text: The text to be analyzed
     :param bool is_input: Whether the text is a user input or a model output
-    :return None: Does not return anything, but will raise `GuardrailException` if 
+    :return None: Does not return anything, but will raise `GuardrailException` if
     the guardrail intervened.
     """
-    response = guardrail_client.apply_guardrail(
-        guardrailIdentifier=settings.BEDROCK_GUARDRAIL_ID,
-        guardrailVersion=settings.BEDROCK_GUARDRAIL_VERSION,
-        source='INPUT'if is_input else 'OUTPUT',
-        content=[
-            {
-                'text': {
-                    'text': text
-                }
-            },
-        ]
-    )
-    action = response.get("action")
-    if action == "GUARDRAIL_INTERVENED":
-        reasons = response.get("assessments")
-        raise GuardrailException(f"Guardrails intervened: {reasons}")
\ No newline at end of file
+    global _calls, _cache_hits, _interventions, _latency
+    source = 'INPUT'if is_input else 'OUTPUT'
+    key = hashlib.sha256(json.dumps([
+        text, source, settings.BEDROCK_GUARDRAIL_ID, settings.BEDROCK_GUARDRAIL_VERSION
+    ]).encode()).hexdigest()
+    cached = verdict_cache.get(key)
+    if cached is not None:
+        verdict = json.loads(cached)
+        with _stats_lock:
+            _cache_hits += 1
+    else:
+        start = time.perf_counter()
+        response = guardrail_client.apply_guardrail(
+            guardrailIdentifier=settings.BEDROCK_GUARDRAIL_ID,
+            guardrailVersion=settings.BEDROCK_GUARDRAIL_VERSION,
+            source=source,
+            content=[
+                {
+                    'text': {
+                        'text': text
+                    }
+                },
+            ]
+        )
+        with _stats_lock:
+            _calls += 1
+            _latency += time.perf_counter() - start
+        verdict = {
+            "intervened": response.get("action") == "GUARDRAIL_INTERVENED",
+            "assessments": response.get("assessments"),
+        }
+        verdict_cache.set(key, json.dumps(verdict, default=str))
+    if verdict["intervened"]:
+        with _stats_lock:
+            _interventions += 1
+        reasons = verdict["assessments"]
+        logger.warning(f"Guardrails intervened on {source.lower()}")
+        raise GuardrailException(f"Guardrails intervened: {reasons}")
+
+
+def submit_guardrail(text: str, is_input: bool = True) -> Future:
+    """
+    Apply guardrail on a piece of text in the background. The returned future raises a 
+    `GuardrailException` if the guardrail intervened.
+
+    :param str text: The text to be analyzed
+    :param bool is_input: Whether the text is a user input or a model output
+    :return Future: The future of the check
+    """
+    return guardrail_executor.submit(apply_guardrail, text, is_input)
+
+
+def guardrail_stats() -> GuardrailStats:
+    """
+    Return a snapshot of the guardrail statistics.
+    """
+    with _stats_lock:
+        return GuardrailStats(
+            enabled=settings.BEDROCK_USE_GUARDRAIL,
+            optimistic=settings.BEDROCK_GUARDRAIL_OPTIMISTIC,
+            calls=_calls,
+            cache_hits=_cache_hits,
+            interventions=_interventions,
+            mean_latency=_latency / _calls if _calls else 0.0,
+        )
@@ -0,0 +1,54 @@
+import time
+
+import requests
+from bs4.dammit import UnicodeDammit
+from loguru import logger
+from requests.adapters import HTTPAdapter
+
+from app.core.config import settings
+from app.dependencies.browser import USER_AGENT
+
+CONNECT_TIMEOUT = 3
+READ_TIMEOUT = 5
+TOTAL_TIMEOUT = 10      # we give up on pages that take more than 10 seconds to download
+MAX_PAGE_SIZE = 5 * 1024 * 1024     # pages larger than 5 MB are cut off
+CHUNK_SIZE = 64 * 1024
+
+http_session = requests.Session()
+http_session.headers.update({
+    "User-Agent": USER_AGENT,
+    "Accept": "text/html,application/xhtml+xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-SG,en;q=0.9",
+})
+# connections are kept alive and reused across requests, up to `HTTP_POOL_SIZE` connections per host
+_adapter = HTTPAdapter(pool_connections=settings.HTTP_POOL_SIZE, pool_maxsize=settings.HTTP_POOL_SIZE)
+http_session.mount("http://", _adapter)
+http_session.mount("https://", _adapter)
+
+def fetch_html(url: str) -> str:
+    """
+    Download the html of a page without rendering it. Blocks the calling thread.
+
+    :param str url: The URL of the web page
+    :return str: The html of the page, or an empty string if it could not be retrieved or is not html
+    """
+    start = time.monotonic()
+    try:
+        with http_session.get(url, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), stream=True) as r:
+            r.raise_for_status()
+            content_type = r.headers.get("Content-Type", "")
+            if "html" not in content_type:
+                logger.debug(f"Skipping {url} with content type '{content_type}'")
+                return ""
+            body = bytearray()
+            for chunk in r.iter_content(CHUNK_SIZE):
+                body += chunk
+                if len(body) >= MAX_PAGE_SIZE or time.monotonic() - start > TOTAL_TIMEOUT:
+                    logger.debug(f"Cut off the download of {url} after {len(body)} bytes")
+                    break
+            # the charset of the response header takes precedence over the one declared in the html
+            encodings = [r.encoding] if "charset" in content_type.lower() else []
+    except Exception as e:
+        logger.warning(f"Failed to download {url}: {e}")
+        return ""
+    return UnicodeDammit(bytes(body), known_definite_encodings=encodings, is_html=True).unicode_markup or ""
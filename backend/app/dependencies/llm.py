@@ -1,19 +1,53 @@
+import asyncio
+import hashlib
+import json
+import threading
 import time
 
 from loguru import logger
 from langchain_aws import BedrockLLM
-from langchain_core.messages import SystemMessage, HumanMessage
+from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage
 
-from app.dependencies.guardrail import apply_guardrail, GuardrailException
+from app.dependencies.cache import create_cache
+from app.dependencies.guardrail import apply_guardrail, submit_guardrail
 from app.core.config import settings
+from app.core.concurrency import bedrock_limiter
+from app.core.json_stream import JsonValueDetector
+from app.core.rate_limit import get_rate_limiter, estimate_tokens
+from app.types.stats import LLMStats
 
 RETRY_LIMIT = 10
-RETRY_DELAY = 2
+# every prompt ends with an open ```json fence, so the completion is over once the model closes it. The 
+# newline goes after the fence, so that a ```json fence opened after some commentary does not match
+STOP_SEQUENCES = ["```\n"]
+# the name of the stop sequence parameter in the Bedrock request body of each provider, which LangChain gets 
+# wrong for some of them (e.g. mistral). Providers that are not listed (e.g. meta, whose models take no stop 
+# sequences) are streamed without them.
+STOP_SEQUENCE_KEYS = {
+    "anthropic": "stop_sequences",
+    "amazon": "stopSequences",     # part of `textGenerationConfig`, which LangChain builds from the model arguments
+    "cohere": "stop_sequences",
+    "mistral": "stop",
+}
+
+rate_limiter = get_rate_limiter(settings.BEDROCK_LLM_ID)
+
+_stats_lock = threading.Lock()
+_invocations = 0
+_cache_hits = 0
+_generations = 0
+_early_stops = 0
+_regenerations = 0
+_stop_sequences_rejected = False    # whether Bedrock rejected the stop sequence parameter of the model
+_invocation_latency = 0.0
+_generation_latency = 0.0
 
 class LLM(BedrockLLM):
     """
     A wrapper built around LangChain's BedrockLLM class that allows us to customise some of the builtin methods.
     """
+    provider_stop_sequence_key_name_map: dict[str, str] = STOP_SEQUENCE_KEYS
+
     def __init__(self):
         # Define LLM API
         kwargs = {
@@ -26,36 +60,289 @@ class LLM(BedrockLLM):
         super().__init__(**kwargs)
 
 
-    def invoke(self, message: HumanMessage, system_message: SystemMessage | None = None) -> str:
+    def invoke(self, message: HumanMessage, system_message: SystemMessage | None = None, use_cache: bool = True) -> str:
         """
-        Custom method wrapped around LangChain's `invoke` method for customisable behaviour.
+        Custom method wrapped around LangChain's `invoke` method for customisable behaviour. Completions are 
+        cached, and a cached completion that already passed the guardrails is returned without checking 
+        them again.
 
         :param HumanMessage message: The user message
         :param SystemMessage system_message: An optional system message
+        :param bool use_cache: Whether to read from and write to the completion cache
         :return str: The generated text from the LLM
         """
-        if settings.BEDROCK_USE_GUARDRAIL:
+        start = time.perf_counter()
+        key = self._cache_key(message, system_message) if use_cache else None
+        output = self._lookup(key, message) if key else None
+        cache_hit = output is not None
+        if not cache_hit:
+            output = self._complete(message, system_message)
+            if key and output:
+                self._store(key, output)
+        _record_invocation(time.perf_counter() - start, cache_hit)
+        return output
+
+
+    async def ainvoke(self, message: HumanMessage, system_message: SystemMessage | None = None, use_cache: bool = True) -> str:
+        """
+        Asynchronous version of `invoke`. Waiting for the rate limiter or backing off after throttling does 
+        not block the event loop.
+
+        :param HumanMessage message: The user message
+        :param SystemMessage system_message: An optional system message
+        :param bool use_cache: Whether to read from and write to the completion cache
+        :return str: The generated text from the LLM
+        """
+        start = time.perf_counter()
+        key = self._cache_key(message, system_message) if use_cache else None
+        output = await asyncio.to_thread(self._lookup, key, message) if key else None
+        cache_hit = output is not None
+        if not cache_hit:
+            output = await self._acomplete(message, system_message)
+            if key and output:
+                await asyncio.to_thread(self._store, key, output)
+        _record_invocation(time.perf_counter() - start, cache_hit)
+        return output
+
+
+    def _lookup(self, key: str, message: HumanMessage) -> str | None:
+        """
+        Retrieve a cached completion, applying the guardrails if they have not seen it yet.
+        """
+        cached = llm_cache.get(key)
+        if cached is None:
+            return None
+        entry = json.loads(cached)
+        output = entry["output"]
+        logger.trace(f"Cached output:\n{output}")
+        # the guardrails have not seen this completion yet if they were enabled after it was cached
+        guardrail = _guardrail_id()
+        if guardrail and entry["guardrail"] != guardrail:
             apply_guardrail(message.content)
-        messages = [message]
-        if system_message:
-            messages = [system_message, message]
+            apply_guardrail(output, False)
+            self._store(key, output)
+        return output
+
+
+    def _store(self, key: str, output: str) -> None:
+        llm_cache.set(key, json.dumps({"output": output, "guardrail": _guardrail_id()}))
+
+
+    def _complete(self, message: HumanMessage, system_message: SystemMessage | None = None) -> str:
+        """
+        Generate a completion with Bedrock, applying the guardrails on the input and output if enabled. In 
+        optimistic mode, the input is checked while the completion is generated, and the completion is 
+        discarded if the guardrail intervened.
+        """
+        input_check = None
+        if settings.BEDROCK_USE_GUARDRAIL:
+            if settings.BEDROCK_GUARDRAIL_OPTIMISTIC:
+                input_check = submit_guardrail(message.content)
+            else:
+                apply_guardrail(message.content)
+        start = time.perf_counter()
+        messages = self._messages(message, system_message)
+        tokens = self._estimate_tokens(messages)
+        output = ""
         for i in range(RETRY_LIMIT):
             try:
-                output = super().invoke(messages)
+                rate_limiter.acquire(tokens)
+                output = self._invoke_bedrock(messages)
+                rate_limiter.on_success()
                 logger.trace(f"Generated output:\n{output}")
-                if settings.BEDROCK_USE_GUARDRAIL:
-                    apply_guardrail(output, False)
-                return output
+                break
             except self.client.exceptions.ThrottlingException as e:  
                 logger.warning(f"Failed to generate output: {e}")
-                time.sleep(RETRY_DELAY * (i + 1))
-            except GuardrailException as e:     # if guardrail intervened, we bubble up the error
-                raise e
+                rate_limiter.on_throttle()  # the next attempt waits in the rate limiter queue
             except BaseException as e:
                 logger.error(f"Fatal error: {e}") 
-                return ""
+                break
+        else:
+            logger.error(f"Failed to generate output after {RETRY_LIMIT} retries")
+        _record_generation(time.perf_counter() - start)
+
+        # if guardrail intervened, we bubble up the error
+        if input_check:
+            input_check.result()
+        if settings.BEDROCK_USE_GUARDRAIL and output:
+            apply_guardrail(output, False)
+        return output
+
+
+    async def _acomplete(self, message: HumanMessage, system_message: SystemMessage | None = None) -> str:
+        """
+        Asynchronous version of `_complete`. The blocking Bedrock and guardrail calls run in worker threads.
+        """
+        input_check = None
+        if settings.BEDROCK_USE_GUARDRAIL:
+            if settings.BEDROCK_GUARDRAIL_OPTIMISTIC:
+                input_check = asyncio.wrap_future(submit_guardrail(message.content))
+            else:
+                await asyncio.to_thread(apply_guardrail, message.content)
+        start = time.perf_counter()
+        messages = self._messages(message, system_message)
+        tokens = self._estimate_tokens(messages)
+        output = ""
+        for i in range(RETRY_LIMIT):
+            try:
+                await rate_limiter.acquire_async(tokens)
+                output = await asyncio.to_thread(self._invoke_bedrock, messages)
+                rate_limiter.on_success()
+                logger.trace(f"Generated output:\n{output}")
+                break
+            except self.client.exceptions.ThrottlingException as e:  
+                logger.warning(f"Failed to generate output: {e}")
+                rate_limiter.on_throttle()
+            except BaseException as e:
+                logger.error(f"Fatal error: {e}") 
+                break
+        else:
+            logger.error(f"Failed to generate output after {RETRY_LIMIT} retries")
+        _record_generation(time.perf_counter() - start)
+
+        if input_check:
+            await input_check
+        if settings.BEDROCK_USE_GUARDRAIL and output:
+            await asyncio.to_thread(apply_guardrail, output, False)
+        return output
+
+
+    def _invoke_bedrock(self, messages: list[BaseMessage]) -> str:
+        if settings.LLM_STREAM_JSON:
+            return self._stream_bedrock(messages)
+        with bedrock_limiter:
+            return super().invoke(messages)
+
+
+    def _stream_bedrock(self, messages: list[BaseMessage]) -> str:
+        """
+        Stream the completion and stop reading it as soon as the first JSON value in it is complete. Models 
+        that support stop sequences also stop generating at the closing fence. If the completion was cut 
+        off before any JSON value started (e.g. at a bare ``` fence opened after some commentary), it is 
+        generated again without stop sequences, which is counted in `regenerations`.
+        """
+        global _stop_sequences_rejected
+        stop_key = None if _stop_sequences_rejected else STOP_SEQUENCE_KEYS.get(self._get_provider())
+        detector = JsonValueDetector()
+        with bedrock_limiter:
+            try:
+                # LangChain writes the stop sequences into a copy of `model_kwargs`, which is empty once the 
+                # temperature has been moved to its own field, so they do not leak into later calls
+                chunks = self._read_stream(messages, detector, STOP_SEQUENCES if stop_key else None)
+            except self.client.exceptions.ValidationException as e:
+                if not stop_key:
+                    raise e
+                # a parameter the model does not take fails the request before anything is generated
+                logger.warning(f"Bedrock rejected the '{stop_key}' parameter of {self.model_id}, streaming without stop sequences: {e}")
+                _stop_sequences_rejected = True
+                stop_key = None
+                detector = JsonValueDetector()
+                chunks = self._read_stream(messages, detector)
+            if stop_key and not detector.started:
+                logger.debug("No JSON value before the stop sequence, generating again without it")
+                _record_regeneration()
+                return super().invoke(messages)
+        return "".join(chunks)
+
+
+    def _read_stream(self, messages: list[BaseMessage], detector: JsonValueDetector, stop: list[str] | None = None) -> list[str]:
+        """
+        Read a streamed completion until the first JSON value in it is complete.
+        """
+        chunks = []
+        stream = super().stream(messages, stop=stop)
+        try:
+            for chunk in stream:
+                chunks.append(chunk)
+                if detector.feed(chunk):
+                    _record_early_stop()
+                    break
+        finally:
+            stream.close()
+        return chunks
+
+
+    def _messages(self, message: HumanMessage, system_message: SystemMessage | None) -> list[BaseMessage]:
+        if system_message:
+            return [system_message, message]
+        return [message]
+
+
+    def _estimate_tokens(self, messages: list[BaseMessage]) -> int:
+        """
+        Estimate the tokens used by a request, counting the maximum number of generated tokens.
+        """
+        return sum(estimate_tokens(m.content) for m in messages) + self.max_tokens
+
+
+    def _cache_key(self, message: HumanMessage, system_message: SystemMessage | None) -> str:
+        """
+        Hash the model id, inference parameters and prompts into a completion cache key.
+        """
+        payload = json.dumps([
+            self.model_id,
+            self.max_tokens,
+            self.model_kwargs,
+            system_message.content if system_message else None,
+            message.content,
+        ], sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _record_invocation(latency: float, cache_hit: bool) -> None:
+    global _invocations, _cache_hits, _invocation_latency
+    with _stats_lock:
+        _invocations += 1
+        _cache_hits += cache_hit
+        _invocation_latency += latency
+
+
+def _record_early_stop() -> None:
+    global _early_stops
+    with _stats_lock:
+        _early_stops += 1
+
+
+def _record_regeneration() -> None:
+    global _regenerations
+    with _stats_lock:
+        _regenerations += 1
+
+
+def _record_generation(latency: float) -> None:
+    global _generations, _generation_latency
+    with _stats_lock:
+        _generations += 1
+        _generation_latency += latency
+
+
+def llm_stats() -> LLMStats:
+    """
+    Return a snapshot of the text LLM statistics. The invocation latency includes cache lookups and guardrail 
+    checks, while the generation latency only covers the Bedrock calls.
+    """
+    with _stats_lock:
+        return LLMStats(
+            guardrail_enabled=settings.BEDROCK_USE_GUARDRAIL,
+            guardrail_optimistic=settings.BEDROCK_GUARDRAIL_OPTIMISTIC,
+            invocations=_invocations,
+            cache_hits=_cache_hits,
+            generations=_generations,
+            early_stops=_early_stops,
+            regenerations=_regenerations,
+            mean_invocation_latency=_invocation_latency / _invocations if _invocations else 0.0,
+            mean_generation_latency=_generation_latency / _generations if _generations else 0.0,
+        )
+
+
+def _guardrail_id() -> str | None:
+    """
+    Identify the guardrail that completions are checked against, or None if guardrails are disabled.
+    """
+    if not settings.BEDROCK_USE_GUARDRAIL:
+        return None
+    return f"{settings.BEDROCK_GUARDRAIL_ID}:{settings.BEDROCK_GUARDRAIL_VERSION}"
+
 
-        logger.error(f"Failed to generate output after {RETRY_LIMIT} retries")
-        return ""
-    
+llm_cache = create_cache("llm_cache", settings.LLM_CACHE_BACKEND, settings.LLM_CACHE_TTL, settings.LLM_CACHE_MAX_SIZE)
 llm = LLM()
\ No newline at end of file
@@ -1,14 +1,23 @@
+import asyncio
 import json
 import time
 
+from botocore.exceptions import ClientError
 from langchain_core.messages import HumanMessage
 from loguru import logger
 import boto3
 
 from app.core.config import settings
+from app.core.concurrency import bedrock_limiter
+from app.core.rate_limit import get_rate_limiter, estimate_tokens
 
 RETRY_LIMIT = 10
+ERROR_RETRY_LIMIT = 3   # attempts after errors other than throttling, which are unlikely to go away
 RETRY_DELAY = 2
+DEFAULT_MAX_TOKENS = 1024
+IMAGE_TOKENS = 1600     # upper bound of the tokens used by a single image
+
+rate_limiter = get_rate_limiter(settings.BEDROCK_MULTIMODAL_ID)
 
 class MultimodalLLM:
     """
@@ -28,44 +37,114 @@ class MultimodalLLM:
         :param str system_message: An optional system message
         :return str: The generated text from the LLM
         """
+        request_body = self._request_body(message, system_message, kwargs)
+        tokens = self._estimate_tokens(request_body)
+        errors = 0
+        for i in range(RETRY_LIMIT):
+            try:
+                rate_limiter.acquire(tokens)
+                content = self._invoke_bedrock(request_body)
+                rate_limiter.on_success()
+                return content
+            except Exception as e:
+                logger.warning(f"Failed to generate output: {e}")
+                if _is_throttling(e):
+                    rate_limiter.on_throttle()  # the next attempt waits in the rate limiter queue
+                    continue
+                errors += 1
+                if errors >= ERROR_RETRY_LIMIT:
+                    break
+                time.sleep(RETRY_DELAY * errors)
+
+        logger.error(f"Failed to generate output after {i + 1} attempts")
+        return ""
+
+    async def ainvoke(self, message: HumanMessage, system_message: str = "", **kwargs) -> str:
+        """
+        Asynchronous version of `invoke`. Waiting for the rate limiter or backing off after an error does 
+        not block the event loop.
+
+        :param HumanMessage message: The user message
+        :param str system_message: An optional system message
+        :return str: The generated text from the LLM
+        """
+        request_body = self._request_body(message, system_message, kwargs)
+        tokens = self._estimate_tokens(request_body)
+        errors = 0
+        for i in range(RETRY_LIMIT):
+            try:
+                await rate_limiter.acquire_async(tokens)
+                content = await asyncio.to_thread(self._invoke_bedrock, request_body)
+                rate_limiter.on_success()
+                return content
+            except Exception as e:
+                logger.warning(f"Failed to generate output: {e}")
+                if _is_throttling(e):
+                    rate_limiter.on_throttle()
+                    continue
+                errors += 1
+                if errors >= ERROR_RETRY_LIMIT:
+                    break
+                await asyncio.sleep(RETRY_DELAY * errors)
+
+        logger.error(f"Failed to generate output after {i + 1} attempts")
+        return ""
+
+    def _request_body(self, message: HumanMessage, system_message: str, inference_config: dict) -> dict:
         request_body = {
             "schemaVersion": "messages-v1",
             "messages": [
                 {"role": "user", "content": message.content}
             ],
-            "inferenceConfig": kwargs,
+            "inferenceConfig": inference_config,
         }
         if system_message:
             request_body["system"] = [{"text": system_message}]
+        return request_body
 
-        for i in range(RETRY_LIMIT):
-            try:
-                response = self.client.invoke_model_with_response_stream(
-                    modelId=settings.BEDROCK_MULTIMODAL_ID, body=json.dumps(request_body)
-                )
-                # Process the response stream
-                stream = response.get("body")
-                if stream:
-                    content = ""
-                    for event in stream:
-                        chunk = event.get("chunk")
-                        if chunk:
-                            chunk_json = json.loads(chunk.get("bytes").decode())
-                            try:
-                                content_chunk = chunk_json["contentBlockDelta"]["delta"]["text"]
-                                if content_chunk:
-                                    content += content_chunk
-                            except: pass
-                else:
-                    logger.warning("No response stream received.")
-                    return ""
-                logger.trace(f"Generated output:\n{content}")
-                return content
-            except Exception as e:
-                logger.warning(f"Failed to generate output: {e}")
-                time.sleep(RETRY_DELAY * (i + 1))
+    def _invoke_bedrock(self, request_body: dict) -> str:
+        """
+        Send a single request to Bedrock and collect the streamed response.
+        """
+        with bedrock_limiter:
+            response = self.client.invoke_model_with_response_stream(
+                modelId=settings.BEDROCK_MULTIMODAL_ID, body=json.dumps(request_body)
+            )
+            # Process the response stream
+            stream = response.get("body")
+            if not stream:
+                logger.warning("No response stream received.")
+                return ""
+            content = ""
+            for event in stream:
+                chunk = event.get("chunk")
+                if chunk:
+                    chunk_json = json.loads(chunk.get("bytes").decode())
+                    try:
+                        content_chunk = chunk_json["contentBlockDelta"]["delta"]["text"]
+                        if content_chunk:
+                            content += content_chunk
+                    except: pass
+        logger.trace(f"Generated output:\n{content}")
+        return content
 
-        logger.error(f"Failed to generate output after {RETRY_LIMIT} retries")
-        return ""
+    def _estimate_tokens(self, request_body: dict) -> int:
+        """
+        Estimate the tokens used by a request, counting the maximum number of generated tokens.
+        """
+        tokens = request_body["inferenceConfig"].get("maxTokens", DEFAULT_MAX_TOKENS)
+        for block in request_body["messages"][0]["content"]:
+            tokens += estimate_tokens(block["text"]) if "text" in block else IMAGE_TOKENS
+        for block in request_body.get("system", []):
+            tokens += estimate_tokens(block["text"])
+        return tokens
     
+def _is_throttling(error: Exception) -> bool:
+    """
+    Whether Bedrock throttled a request, either when it was sent (`ThrottlingException`) or while its 
+    response was streamed (an `EventStreamError` with the `throttlingException` code).
+    """
+    return isinstance(error, ClientError) and error.response.get("Error", {}).get("Code", "").lower() == "throttlingexception"
+
+
 multimodal_llm = MultimodalLLM()
\ No newline at end of file
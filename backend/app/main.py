@@ -1,8 +1,11 @@
+import asyncio
 from fastapi import FastAPI
 from contextlib import asynccontextmanager
 
 from app.core.logging import config_logger
-from app.api import infer, health
+from app.api import infer, health, stats, venues
+from app.dependencies.browser import browser_pool
+from app.services.jobs import job_manager
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -10,10 +13,16 @@ async def lifespan(app: FastAPI):
     Manage application dependencies
     """
     config_logger()
+    await asyncio.to_thread(browser_pool.start)
+    job_manager.start()
     yield
+    await asyncio.to_thread(job_manager.stop)
+    await asyncio.to_thread(browser_pool.stop)
 
 
 app = FastAPI(lifespan=lifespan)
 
 app.include_router(health.router, prefix="/health", tags=["Misc"])
+app.include_router(stats.router, prefix="/stats", tags=["Misc"])
 app.include_router(infer.router, prefix="/infer", tags=["Infer"])
+app.include_router(venues.router, prefix="/admin/venues", tags=["Admin"])
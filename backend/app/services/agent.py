@@ -1,14 +1,31 @@
-import json
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import closing
+from typing import Iterator
 
 from loguru import logger
 
 from app.types.schema import LocationData
+from app.types.venue import StoredVenue
+from app.types.events import VenueEvent, CaptionEvent, DoneEvent
+from app.types.model_outputs import PreliminaryLocationData
 from app.core.config import settings
 from app.services.tools.search import search_duckduckgo
-from app.services.tools.scraper import scrape
-from app.services.tools.structured_output import get_preliminary_location, get_candidate_locations, get_search_queries, update_location_data
+from app.services.tools.scraper import scrape, scrape_concurrently
+from app.services.tools.structured_output import (
+    get_preliminary_location, 
+    get_candidate_locations, 
+    get_search_queries)
+from app.services.merge import merge_location_data
+from app.services.evidence import EvidenceStore
+from app.services.candidates import CandidateIndex
+from app.services.venues import VENUE_FIELDS, venue_store
 from app.services.tools.image_processing import generate_caption_hashtags
-from app.services.utils import initialise_preliminary_locations, preliminary_to_final_location_data
+from app.services.utils import (
+    initialise_preliminary_locations, 
+    preliminary_to_final_location_data, 
+    final_to_preliminary_location_data, 
+    missing_fields, 
+    location_completeness)
 from app.dependencies.guardrail import apply_guardrail
 
 def extract_locations(query: str, n_results: int, n_iterations: int) -> list[LocationData]:
@@ -22,92 +39,268 @@ def extract_locations(query: str, n_results: int, n_iterations: int) -> list[Loc
     number of iterations will yield more accurate results, at the cost of computation time.
     :return list[LocationData]: The list of location information 
     """
+    results: dict[int, LocationData] = {}
+    for event in stream_locations(query, n_results, n_iterations):
+        if isinstance(event, VenueEvent):
+            results[event.index] = event.venue
+        elif isinstance(event, CaptionEvent):
+            results[event.index].images[event.image].caption = event.caption
+            results[event.index].images[event.image].hashtags = event.hashtags
+    return [results[i] for i in sorted(results)]
+
+
+def stream_locations(query: str, n_results: int, n_iterations: int) -> Iterator[VenueEvent | CaptionEvent | DoneEvent]:
+    """
+    Same as `extract_locations`, but yields each location as soon as it has been enriched, followed by the 
+    captions of its images as they are generated. Locations are yielded in order of completion, and their 
+    `index` gives their rank.
+
+    :param str query: The user query 
+    :param int n_results: The number of locations to return
+    :param int n_iterations: The number of iterations to run the agentic portion of the workflow.
+    :return Iterator[VenueEvent | CaptionEvent | DoneEvent]: The stream of events, ending with a `DoneEvent`
+    """
     # validate that input is sanitary
     if settings.BEDROCK_USE_GUARDRAIL:
         apply_guardrail(query)
     
+    evidence = EvidenceStore()
+    candidates = CandidateIndex()   # names that refer to the same venue are collapsed
+    locations = _find_candidate_locations(query, n_results, evidence, candidates)
+
+    # venues enriched by earlier requests are served from the venue store, and only their stale fields are 
+    # enriched again. A venue may have been stored under any of the names it was found under.
+    stored: dict[str, StoredVenue] = {}
+    for name in locations if settings.VENUE_STORE_ENABLED else []:
+        entry = next(filter(None, map(venue_store.get, candidates.aliases(name))), None)
+        if entry:
+            stored[name] = entry
+    stored_captions = {
+        image.url: (image.caption, image.hashtags) 
+        for entry in stored.values() for image in entry.venue.images.values() if image.caption
+    }
+
+    # create a PreliminaryLocationData object for each location, with only the name or the fresh stored fields
+    preliminary_locations = initialise_preliminary_locations(locations)
+    for i, name in enumerate(locations):
+        if name in stored:
+            preliminary_locations[i] = _fresh_location_data(name, stored[name])
+
+    # attempt to fill in the details of each preliminary location using an iterative approach
+    # each location is independent of the others, so they are enriched concurrently, and the images of 
+    # each location are captioned as soon as the location is ready
+    logger.info(f"Search for more information regarding: {locations}")
+    enrichment = ThreadPoolExecutor(max_workers=settings.ENRICHMENT_CONCURRENCY, thread_name_prefix="enrichment")
+    captioning = ThreadPoolExecutor(max_workers=settings.CAPTION_CONCURRENCY, thread_name_prefix="caption")
+    extraction = ThreadPoolExecutor(max_workers=settings.ENRICHMENT_CONCURRENCY, thread_name_prefix="extraction")
+    try:
+        results: dict[int, LocationData] = {}
+        for i, name in enumerate(locations):
+            if name in stored and not stored[name].stale_fields:
+                logger.info(f"Serving {name} from the venue store")
+                results[i] = stored[name].venue
+                completeness = location_completeness(preliminary_locations[i])
+                yield VenueEvent(index=i, venue=results[i], completeness=completeness, iterations=0)
+        refresh = [name for i, name in enumerate(locations) if i not in results]
+        logger.info(f"Served {len(results)} location(s) from the venue store, enriching {len(refresh)}")
+
+        # the pages of the first stage already describe the candidates found on them, so the details of all 
+        # the candidates of a page are extracted together, and each candidate starts from these details
+        evidence.extract(refresh, extraction)
+        venues = {
+            enrichment.submit(
+                _enrich_location, 
+                preliminary_locations[i], 
+                n_iterations, 
+                evidence, 
+                stored[name].venue.citation if name in stored else None
+            ): i 
+            for i, name in enumerate(locations) if i not in results
+        }
+        total_iterations = 0
+        captions: dict[str, Future] = {}    # each unique image url is only captioned once
+        images: dict[Future, list[tuple[int, str]]] = {}
+        pending = set(venues)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in venues:
+                    index = venues[future]
+                    venue, iterations, completeness = future.result()
+                    total_iterations += iterations
+                    # images kept from the venue store are not captioned again
+                    for image in venue.images.values():
+                        image.caption, image.hashtags = stored_captions.get(image.url, ("", []))
+                    results[index] = venue
+                    logger.trace(venue.model_dump())
+                    yield VenueEvent(index=index, venue=venue, completeness=completeness, iterations=iterations)
+                    # generate/refine captions for each image
+                    for name, image in venue.images.items():
+                        if image.caption:
+                            continue
+                        if image.url not in captions:
+                            captions[image.url] = captioning.submit(generate_caption_hashtags, image.url)
+                        images.setdefault(captions[image.url], []).append((index, name))
+                        pending.add(captions[image.url])
+                else:
+                    caption, hashtags = future.result()
+                    for index, name in images.pop(future, []):
+                        results[index].images[name].caption = caption
+                        results[index].images[name].hashtags = hashtags
+                        yield CaptionEvent(index=index, image=name, caption=caption, hashtags=hashtags)
+
+        if settings.VENUE_STORE_ENABLED:
+            for index in venues.values():
+                name = locations[index]
+                if name in stored:    # kept under the key it was found under
+                    venue_store.save(stored[name].key, results[index], stored[name].stale_fields)
+                else:
+                    venue_store.save(name, results[index], VENUE_FIELDS)
+    finally:
+        # stop scheduling work if the consumer went away early
+        enrichment.shutdown(wait=False, cancel_futures=True)
+        captioning.shutdown(wait=False, cancel_futures=True)
+        extraction.shutdown(wait=False, cancel_futures=True)
+
+    # iterations saved by complete and stored locations could be spent on raising `n_iterations` for the others
+    iterations_saved = len(locations) * n_iterations - total_iterations
+    logger.info(f"Ran {total_iterations} search iteration(s) for {len(locations)} location(s), saving {iterations_saved}")
+    yield DoneEvent(count=len(locations), iterations=total_iterations, iterations_saved=iterations_saved)
+
+
+def _find_candidate_locations(query: str, n_results: int, evidence: EvidenceStore, candidates: CandidateIndex) -> list[str]:
+    """
+    Search the web for pages relevant to the query and extract the names of candidate locations from them.
+
+    :param str query: The user query
+    :param int n_results: The number of locations to return
+    :param EvidenceStore evidence: The store to record each page and the candidates found on it in
+    :param CandidateIndex candidates: The index to collapse the names of the candidates in, which keeps 
+    every name each candidate was found under
+    :return list[str]: At most `n_results` names of candidate locations
+    """
     # craft a list of candidate locations
     logger.info(f"Searching for pages relevant to '{query}'")
     sg_query = query + " Singapore"
     main_urls = search_duckduckgo(sg_query)
-    locations: list[str] = []
     logger.info(f"Searching for information in these pages: {main_urls}")
-    for result in main_urls:
-        content = scrape(result)
+    # all pages are loaded concurrently, and candidates are extracted from each page as soon as it is ready
+    with closing(scrape_concurrently(main_urls, query=sg_query)) as pages:
+        for result, content in pages:
+            if not content:
+                logger.warning(f"Failed to retrieve any content from {result}")
+                continue
+            candidate_locations = [candidates.add(l) for l in get_candidate_locations(content, sg_query) if l]
+            evidence.add_page(result, content, [l for l in candidate_locations if l])
+
+            logger.trace(candidates.names())
+            if len(candidates) >= n_results:
+                break   # pages that are still loading are cancelled
+
+    return candidates.names()[:n_results]
+
+
+def _enrich_location(
+    location: PreliminaryLocationData, 
+    n_iterations: int, 
+    evidence: EvidenceStore | None = None,
+    citations: list[str] | None = None
+) -> tuple[LocationData, int, float]:
+    """
+    Iteratively search for, scrape and extract the details of a single candidate location. The search 
+    stops early once the location is complete enough, and each search targets the fields still missing.
+
+    :param PreliminaryLocationData location: The initial (mostly empty) data of the location
+    :param int n_iterations: The maximum number of search iterations to run for this location
+    :param EvidenceStore evidence: The pages the location was found on. The location starts from the details 
+    extracted from these pages before any search is run.
+    :param list[str] citations: The sources of the details already known in `location`
+    :return tuple[LocationData, int, float]: The enriched location data with empty image captions, the 
+    number of iterations run and the completeness of the location
+    """
+    current = location
+    visited_urls = list(citations or [])
+    citations = list(citations or [])
+    iterations = 0
+    seeds = []
+    for url, location_data in evidence.evidence(location.name) if evidence else []:
+        visited_urls.append(url)
+        if location_completeness(current) == 0:
+            current = location_data
+            seeds.append(url)
+            continue
+        merge = merge_location_data(current, location_data)
+        if merge.changes:
+            current = merge.location
+            seeds.append(url)
+    if seeds:
+        logger.info(f"Started {location.name} from the details found on {seeds}")
+    citations.extend(url for url in seeds if url not in citations)
+    for iter_count in range(n_iterations):  # iterate up to n times to refine the information of each candidate location
+        missing = missing_fields(current)
+        if location_completeness(current) >= settings.ENRICHMENT_COMPLETENESS_THRESHOLD:
+            logger.info(f"Stopped searching for {location.name} after {iter_count} iteration(s)")
+            break
+        iterations += 1
+        search_queries = get_search_queries(location.name + " Singapore", current, missing)
+        logger.trace(f"Search queries: {search_queries}")
+        if not search_queries:
+            continue
+
+        # extract data from first search query
+        query = search_queries[0]
+        urls = search_duckduckgo(query, max_results=5)
+        logger.trace(f"URLs: {urls}")
+        urls = [s for s in urls if s not in visited_urls]  # check if URL has been visited already
+        if not urls:
+            continue
+        
+        # limit search to top scrapable and unvisited URL
+        content = ""
+        for url in urls:
+            logger.info(f"Attempting to retrieve relevant information from {url}")
+            content = scrape(url, query)
+            visited_urls.append(url)
+            if content:
+                break
         if not content:
-            logger.warning(f"Failed to retrieve any content from {result}")
+            logger.warning(f"No content could be scraped from these urls: {urls}")
             continue
-        candidate_locations = get_candidate_locations(content, sg_query)
-        locations.extend([l for l in candidate_locations if l])
 
-        logger.trace(locations)
-        if len(locations) >= n_results:
-            break
+        # attempt to extract information and parse into PreliminaryLocationData object
+        location_data = get_preliminary_location(content, location.name)
+        logger.trace(location_data.model_dump() if location_data else "No location data extracted")
+        if not location_data:
+            continue
 
-    # create an empty PreliminaryLocationData object for each location
-    preliminary_locations = initialise_preliminary_locations(locations[:n_results])
+        # Update previous location data with newly extracted information
+        # save 1 LLM call if nothing is known yet
+        if location_completeness(current) == 0:     
+            current = location_data
+            citations.append(url)
+            continue
+        # most fields are merged by rules, and the LLM is only asked about conflicting values
+        merge = merge_location_data(current, location_data)
+        logger.trace([change.model_dump() for change in merge.changes])
+        if merge.changes:
+            current = merge.location
+            citations.append(url)
 
-    # attempt to fill in the details of each preliminary location using an iterative approach
-    logger.info(f"Search for more information regarding: {locations}")
-    results: list[LocationData] = []
-    for i, location in enumerate(preliminary_locations):
-        visited_urls = []
-        citations = []
-        for iter_count in range(n_iterations):  # iterate up to n times to refine the information of each candidate location
-            search_queries = get_search_queries(location.name + " Singapore", preliminary_locations[i])
-            logger.trace(f"Search queries: {search_queries}")
-            if not search_queries:
-                continue
+    return preliminary_to_final_location_data(current, citations), iterations, location_completeness(current)
 
-            # extract data from first search query
-            query = search_queries[0]
-            urls = search_duckduckgo(query, max_results=5)
-            logger.trace(f"URLs: {urls}")
-            urls = [s for s in urls if s not in visited_urls]  # check if URL has been visited already
-            if not urls:
-                continue
-            
-            # limit search to top scrapable and unvisited URL
-            content = ""
-            for url in urls:
-                logger.info(f"Attempting to retrieve relevant information from {url}")
-                content = scrape(url)
-                visited_urls.append(url)
-                if content:
-                    break
-            if not content:
-                logger.warning(f"No content could be scraped from these urls: {urls}")
-                continue
 
-            # attempt to extract information and parse into PreliminaryLocationData object
-            location_data = get_preliminary_location(content, location.name)
-            logger.trace(location_data.model_dump() if location_data else "No location data extracted")
-            if not location_data:
-                continue
+def _fresh_location_data(name: str, entry: StoredVenue) -> PreliminaryLocationData:
+    """
+    Convert a stored venue into the starting point of its enrichment, leaving its stale fields empty so 
+    that they are searched for again.
 
-            # Update previous location data with newly extracted information
-            # save 1 LLM call if it's the first iteration
-            if iter_count == 0:     
-                preliminary_locations[i] = location_data
-                citations.append(url)
-                continue
-            previous_json = preliminary_locations[i].model_dump_json()
-            combined_data = update_location_data(preliminary_locations[i], location_data)
-            changes = previous_json != combined_data.model_dump_json()
-            if changes:
-                preliminary_locations[i] = combined_data
-                citations.append(url)
-
-        transformed_data = preliminary_to_final_location_data(preliminary_locations[i], citations)
-        logger.trace(transformed_data.model_dump())
-        results.append(transformed_data)
-
-    logger.debug(f"Pre-captioned data: {[r.model_dump() for r in results]}")
-    # generate/refine captions for each image
-    for i, r in enumerate(results):
-        for name in r.images:
-            caption, hashtags = generate_caption_hashtags(r.images[name].url)
-            results[i].images[name].caption = caption
-            results[i].images[name].hashtags = hashtags
-
-    return results
+    :param str name: The name of the candidate location the venue was stored under
+    :param StoredVenue entry: The stored venue
+    :return PreliminaryLocationData: The fresh fields of the venue, under the name of the candidate
+    """
+    location = final_to_preliminary_location_data(entry.venue)
+    location.name = name
+    blank = initialise_preliminary_locations([name])[0]
+    for field in entry.stale_fields:
+        setattr(location, field, getattr(blank, field))
+    return location
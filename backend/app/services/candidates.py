@@ -0,0 +1,161 @@
+import re
+import unicodedata
+
+from loguru import logger
+
+from app.core.config import settings
+
+# words that do not tell venues apart, e.g. "The Marina Bay Sands Singapore" and "Marina Bay Sands"
+STOP_WORDS = {"the", "a", "an", "of", "at", "by", "and", "in", "on", "singapore", "sg", "pte", "ltd"}
+# words that describe the kind of venue rather than which venue it is, e.g. "Lau Pa Sat Festival Market"
+GENERIC_WORDS = {
+    "restaurant", "cafe", "bar", "bistro", "eatery", "kitchen", "hawker", "food", "centre", "center", "court",
+    "market", "festival", "mall", "shopping", "hotel", "resort", "museum", "gallery", "park", "complex", 
+    "building", "official", "outlet", "store", "shop",
+}
+NGRAM_SIZE = 3
+
+
+def normalize_name(name: str) -> str:
+    """
+    Fold the case, accents and punctuation of a venue name, e.g. "Café  Kreams!" becomes "cafe kreams".
+
+    :param str name: The name of the venue
+    :return str: The normalized name
+    """
+    name = unicodedata.normalize("NFKD", name.casefold())
+    name = "".join(c for c in name if not unicodedata.combining(c)).replace("&", " and ")
+    return " ".join(re.sub(r"[^\w\s]", " ", name).split())
+
+
+def name_key(name: str) -> str:
+    """
+    Reduce a venue name to the words that tell venues apart, e.g. "The Marina Bay Sands, Singapore" becomes 
+    "marina bay sands".
+
+    :param str name: The name of the venue
+    :return str: The normalized name without stop words, which is empty if the name only has stop words
+    """
+    return " ".join(token for token in normalize_name(name).split() if token not in STOP_WORDS)
+
+
+class _Entry:
+    """
+    A distinct venue, with every name it was found under.
+    """
+    __slots__ = ("name", "aliases", "tokens", "ngrams", "initials")
+
+    def __init__(self, name: str, tokens: list[str]):
+        self.name = name
+        self.aliases = [name]
+        self.tokens = tokens
+        self.ngrams = _ngrams(tokens)
+        self.initials = "".join(token[0] for token in tokens) if len(tokens) > 1 else ""
+
+
+class CandidateIndex:
+    """
+    Collapses the names of candidate locations that refer to the same venue, so that each venue is only
+    enriched once. Names are compared after folding case, accents and punctuation and removing stop words.
+    Two names refer to the same venue if one of them only adds generic words (e.g. "restaurant") to the 
+    other, or is its acronym (e.g. "MBS"), or if their character n-grams are similar enough. A name that 
+    refers to several venues that are distinct from each other (e.g. "Din Tai Fung" after "Din Tai Fung 
+    Paragon" and "Din Tai Fung Jewel") is kept as a venue of its own rather than collapsed into one of them.
+    """
+    def __init__(self, threshold: float = settings.CANDIDATE_SIMILARITY_THRESHOLD):
+        self.threshold = threshold
+        self._entries: list[_Entry] = []
+        self._postings: dict[str, set[int]] = {}    # the entries that contain each n-gram
+        self._acronyms: dict[str, set[int]] = {}    # the entries whose initials form each acronym
+        self._tokens: dict[str, set[int]] = {}      # the entries that contain each word
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, name: str) -> str | None:
+        """
+        Add the name of a candidate location to the index.
+
+        :param str name: The name of the candidate location
+        :return str | None: The name of the venue the candidate was collapsed into (the name it was first
+        found under), or None if the name is empty
+        """
+        tokens = name_key(name).split()
+        if not tokens:
+            return None
+        candidate = _Entry(name, tokens)
+        match = self._match(candidate)
+        if match:
+            if name not in match.aliases:
+                logger.debug(f"Collapsed candidate '{name}' into '{match.name}'")
+                match.aliases.append(name)
+            return match.name
+
+        position = len(self._entries)
+        self._entries.append(candidate)
+        for ngram in candidate.ngrams:
+            self._postings.setdefault(ngram, set()).add(position)
+        for token in tokens:
+            self._tokens.setdefault(token, set()).add(position)
+        if candidate.initials:
+            self._acronyms.setdefault(candidate.initials, set()).add(position)
+        return name
+
+    def names(self) -> list[str]:
+        """
+        Return the name of each distinct venue, in the order they were first found.
+        """
+        return [entry.name for entry in self._entries]
+
+    def aliases(self, name: str) -> list[str]:
+        """
+        Return every name a venue was found under.
+
+        :param str name: The name of the venue, as returned by `add`
+        :return list[str]: The names of the venue, starting with `name`
+        """
+        for entry in self._entries:
+            if entry.name == name:
+                return entry.aliases
+        return []
+
+    def _match(self, candidate: _Entry) -> _Entry | None:
+        """
+        Return the entry that refers to the same venue as a candidate, if there is exactly one.
+        """
+        # only the entries that share an n-gram with the candidate, or whose acronym is a word of the 
+        # other, can refer to the same venue
+        positions = set().union(*(self._postings.get(ngram, ()) for ngram in candidate.ngrams))
+        positions |= set().union(*(self._acronyms.get(token, ()) for token in candidate.tokens))
+        positions |= self._tokens.get(candidate.initials, set())
+        matches = [
+            self._entries[position] for position in sorted(positions)
+            if _dice(candidate.ngrams, self._entries[position].ngrams) >= self.threshold 
+            or _contains(candidate, self._entries[position]) or _contains(self._entries[position], candidate)
+        ]
+        if len(matches) > 1:
+            logger.debug(f"Kept candidate '{candidate.name}' apart from {[entry.name for entry in matches]}")
+            return None
+        return matches[0] if matches else None
+
+
+def _contains(a: _Entry, b: _Entry) -> bool:
+    """
+    Whether the name of `a` is the name of `b`, which must have at least two words, with only generic words
+    added, after expanding the acronym of `b` in `a`.
+    """
+    if len(b.tokens) < 2:
+        return False
+    words = set()
+    for token in a.tokens:
+        words.update(b.tokens if token == b.initials else [token])
+    return set(b.tokens) <= words and words - set(b.tokens) <= GENERIC_WORDS
+
+
+def _ngrams(tokens: list[str]) -> set[str]:
+    text = " ".join(tokens)
+    return {text[i:i + NGRAM_SIZE] for i in range(max(len(text) - NGRAM_SIZE + 1, 1))}
+
+
+def _dice(a: set[str], b: set[str]) -> float:
+    return 2 * len(a & b) / (len(a) + len(b)) if a or b else 0.0
@@ -0,0 +1,77 @@
+from concurrent.futures import Executor, Future
+
+from loguru import logger
+
+from app.types.model_outputs import PreliminaryLocationData
+from app.services.tools.structured_output import get_preliminary_locations
+from app.services.utils import location_completeness
+
+
+class EvidenceStore:
+    """
+    Keeps the pages scraped while looking for candidate locations for the duration of a request, together
+    with the candidates found on each page, so that the details of each candidate can be extracted from
+    the pages that mention it before searching for it again.
+    """
+    def __init__(self):
+        self._pages: dict[str, str] = {}
+        self._candidates: dict[str, list[str]] = {}
+        self._extractions: dict[str, tuple[list[str], Future]] = {}
+
+    def add_page(self, url: str, content: str, candidates: list[str]) -> None:
+        """
+        Record a scraped page and the candidate locations found on it.
+
+        :param str url: The URL of the page
+        :param str content: The content of the page
+        :param list[str] candidates: The names of the candidate locations found on the page
+        """
+        self._pages[url] = content
+        self._candidates[url] = list(dict.fromkeys(candidates))
+
+    def sources(self, name: str) -> list[str]:
+        """
+        Return the URLs of the pages a candidate location was found on, in the order they were added.
+
+        :param str name: The name of the candidate location
+        :return list[str]: The URLs of the pages
+        """
+        return [url for url, candidates in self._candidates.items() if name in candidates]
+
+    def extract(self, names: list[str], executor: Executor) -> None:
+        """
+        Start extracting the details of the given candidate locations from every page they were found on,
+        with one batch extraction per page.
+
+        :param list[str] names: The names of the candidate locations to extract
+        :param Executor executor: The executor to run the extractions on
+        """
+        for url, candidates in self._candidates.items():
+            batch = [name for name in candidates if name in names]
+            if batch and url not in self._extractions:
+                self._extractions[url] = (batch, executor.submit(get_preliminary_locations, self._pages[url], batch))
+
+    def evidence(self, name: str) -> list[tuple[str, PreliminaryLocationData]]:
+        """
+        Return the details of a candidate location extracted from each page it was found on, waiting for
+        the extractions started by `extract` to finish. Pages without any details of the location are
+        left out.
+
+        :param str name: The name of the candidate location
+        :return list[tuple[str, PreliminaryLocationData]]: The URL of each page and the details extracted
+        """
+        results = []
+        for url in self.sources(name):
+            if url not in self._extractions:
+                continue
+            batch, extraction = self._extractions[url]
+            if name not in batch:
+                continue
+            try:
+                location = extraction.result()[batch.index(name)]
+            except Exception as e:
+                logger.warning(f"Failed to extract {name} from {url}: {e}")
+                continue
+            if location and location_completeness(location) > 0:
+                results.append((url, location))
+        return results
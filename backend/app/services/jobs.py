@@ -0,0 +1,298 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
+from loguru import logger
+
+from app.core.config import settings
+from app.services.agent import stream_locations
+from app.types.events import VenueEvent, CaptionEvent
+from app.types.job import Job, JobStatus
+from app.types.payload import SearchPayload
+from app.types.schema import LocationData
+
+
+class JobStore:
+    """
+    Persists jobs in a local SQLite database so that they can be retrieved by any API worker and survive restarts.
+    Each unfinished job is leased by the process running it, so that processes sharing the database (several 
+    API workers, or an old and a new container during a deploy) never run the same job twice.
+    """
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, data TEXT NOT NULL, status TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        # databases created before jobs were leased
+        columns = {row[1] for row in self._connection.execute("PRAGMA table_info(jobs)")}
+        if "owner" not in columns:
+            self._connection.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+        if "lease_until" not in columns:
+            self._connection.execute("ALTER TABLE jobs ADD COLUMN lease_until REAL")
+        self._lock = threading.Lock()
+
+    def get(self, job_id: str) -> Job | None:
+        with self._lock:
+            row = self._connection.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return Job.model_validate_json(row[0]) if row else None
+
+    def insert(self, job: Job, owner: str, lease_until: float) -> None:
+        """
+        Store a new job, leased by the process that will run it.
+        """
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO jobs (id, data, status, updated_at, owner, lease_until) VALUES (?, ?, ?, ?, ?, ?)",
+                (job.id, job.model_dump_json(), job.status, job.updated_at, owner, lease_until)
+            )
+
+    def save(self, job: Job, owner: str) -> bool:
+        """
+        Update a job, unless its lease was taken over by another process.
+
+        :param Job job: The job
+        :param str owner: The process updating the job
+        :return bool: Whether the job is still leased by `owner` and was updated
+        """
+        with self._lock:
+            return self._connection.execute(
+                "UPDATE jobs SET data = ?, status = ?, updated_at = ? WHERE id = ? AND owner = ?",
+                (job.model_dump_json(), job.status, job.updated_at, job.id, owner)
+            ).rowcount > 0
+
+    def claim(self, job_id: str, owner: str, lease_until: float) -> bool:
+        """
+        Atomically lease an unfinished job that is not leased, or whose lease has expired.
+
+        :param str job_id: The id of the job
+        :param str owner: The process claiming the job
+        :param float lease_until: The UNIX timestamp at which the lease expires unless it is renewed
+        :return bool: Whether the job was claimed
+        """
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                claimed = self._connection.execute(
+                    "UPDATE jobs SET owner = ?, lease_until = ? WHERE id = ? AND status IN ('queued', 'running') "
+                    "AND (owner IS NULL OR lease_until IS NULL OR lease_until < ?)",
+                    (owner, lease_until, job_id, time.time())
+                ).rowcount > 0
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+        return claimed
+
+    def renew(self, job_ids: list[str], owner: str, lease_until: float) -> set[str]:
+        """
+        Extend the leases of jobs held by a process.
+
+        :return set[str]: The ids of the jobs that are still leased by `owner`
+        """
+        renewed = set()
+        with self._lock:
+            for job_id in job_ids:
+                if self._connection.execute(
+                    "UPDATE jobs SET lease_until = ? WHERE id = ? AND owner = ?", (lease_until, job_id, owner)
+                ).rowcount > 0:
+                    renewed.add(job_id)
+        return renewed
+
+    def release(self, job_ids: list[str], owner: str) -> None:
+        """
+        Give up the leases of jobs held by a process, so that other processes can resume them right away.
+        """
+        with self._lock:
+            for job_id in job_ids:
+                self._connection.execute(
+                    "UPDATE jobs SET owner = NULL, lease_until = NULL WHERE id = ? AND owner = ?", (job_id, owner)
+                )
+
+    def unfinished(self) -> list[Job]:
+        """
+        Return the unfinished jobs that are not leased, or whose lease has expired.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT data FROM jobs WHERE status IN ('queued', 'running') "
+                "AND (owner IS NULL OR lease_until IS NULL OR lease_until < ?) ORDER BY updated_at",
+                (time.time(),)
+            ).fetchall()
+        return [Job.model_validate_json(row[0]) for row in rows]
+
+    def purge(self, before: float) -> int:
+        """
+        Delete finished jobs that were last updated before the given UNIX timestamp.
+        """
+        with self._lock:
+            return self._connection.execute(
+                "DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND updated_at < ?", (before,)
+            ).rowcount
+
+
+class _LeaseLost(Exception):
+    """
+    Raised when a job was taken over by another process, e.g. because its lease could not be renewed in time.
+    """
+
+
+class JobManager:
+    """
+    Runs submitted jobs on a pool of background workers and records their progress in the job store. The 
+    leases of the jobs held by the manager are renewed every third of `JOB_LEASE`, and unfinished jobs whose 
+    lease has expired (e.g. because the process running them died) are claimed and resumed.
+    """
+    def __init__(self, store: JobStore, max_workers: int):
+        self.store = store
+        self.max_workers = max_workers
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._executor: ThreadPoolExecutor | None = None
+        self._held: set[str] = set()    # the jobs leased by this manager, queued or running
+        self._held_lock = threading.Lock()
+        self._stopped = threading.Event()  # set when the manager is stopping, for the workers to stop too
+        self._closed = threading.Event()   # set once the workers have stopped, for the leases to stop being renewed
+        self._maintenance: threading.Thread | None = None
+
+    def start(self) -> None:
+        """
+        Start the workers, resuming jobs that were interrupted by a restart.
+        """
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="job")
+        purged = self.store.purge(time.time() - settings.JOB_RETENTION)
+        if purged:
+            logger.info(f"Purged {purged} expired jobs")
+        self._stopped.clear()
+        self._closed.clear()
+        self._resume()
+        self._maintenance = threading.Thread(target=self._maintain, name="job-leases", daemon=True)
+        self._maintenance.start()
+
+    def stop(self) -> None:
+        """
+        Stop accepting jobs. Running jobs stop after their next event, and their leases keep being renewed 
+        until they have stopped. Jobs that have not finished are then released, and resumed by another
+        process.
+        """
+        self._stopped.set()
+        if self._executor:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+        self._closed.set()
+        if self._maintenance:
+            self._maintenance.join()
+            self._maintenance = None
+        with self._held_lock:
+            held, self._held = list(self._held), set()
+        self.store.release(held, self.owner)
+
+    def submit(self, request: SearchPayload) -> Job:
+        """
+        Queue a search request.
+
+        :param SearchPayload request: The search request
+        :return Job: The queued job
+        """
+        now = time.time()
+        job = Job(id=uuid.uuid4().hex, status="queued", request=request, results=[], version=0, created_at=now, updated_at=now)
+        with self._held_lock:
+            self._held.add(job.id)
+        self.store.insert(job, self.owner, now + settings.JOB_LEASE)
+        # the worker updates its own copy, so that the returned job is not modified concurrently
+        self._executor.submit(self._run, job.model_copy(deep=True))
+        return job
+
+    def _resume(self) -> None:
+        """
+        Claim and queue the unfinished jobs that are not leased by a live process.
+        """
+        for job in self.store.unfinished():
+            if self._stopped.is_set():
+                return
+            if not self.store.claim(job.id, self.owner, time.time() + settings.JOB_LEASE):
+                continue    # claimed by another process in the meantime
+            job = self.store.get(job.id)    # the previous owner may have updated it before its lease expired
+            logger.info(f"Resuming job {job.id}")
+            with self._held_lock:
+                self._held.add(job.id)
+            try:
+                self._update(job, status="queued", results=[])
+            except _LeaseLost:
+                continue
+            self._executor.submit(self._run, job)
+
+    def _maintain(self) -> None:
+        while not self._closed.wait(settings.JOB_LEASE / 3):
+            try:
+                with self._held_lock:
+                    held = list(self._held)
+                renewed = self.store.renew(held, self.owner, time.time() + settings.JOB_LEASE)
+                with self._held_lock:
+                    self._held -= set(held) - renewed
+                for job_id in set(held) - renewed:
+                    logger.warning(f"Lost the lease of job {job_id}")
+                self._resume()
+            except Exception:
+                logger.error(traceback.format_exc())
+
+    def _run(self, job: Job) -> None:
+        with self._held_lock:
+            if job.id not in self._held or self._stopped.is_set():
+                return
+        results: dict[int, LocationData] = {}
+        finished = True     # whether the job no longer needs this process, i.e. it finished or was taken over
+        try:
+            self._update(job, status="running")
+            request = job.request
+            with closing(stream_locations(request.query, request.num_results, request.num_iterations)) as events:
+                for event in events:
+                    if self._stopped.is_set():
+                        logger.info(f"Stopping job {job.id}, it is resumed by another process")
+                        finished = False
+                        return
+                    if isinstance(event, VenueEvent):
+                        results[event.index] = event.venue
+                    elif isinstance(event, CaptionEvent):
+                        results[event.index].images[event.image].caption = event.caption
+                        results[event.index].images[event.image].hashtags = event.hashtags
+                    else:
+                        continue
+                    self._update(job, results=[results[i] for i in sorted(results)])
+            self._update(job, status="succeeded")
+        except _LeaseLost:
+            logger.warning(f"Job {job.id} was taken over by another process, stopping")
+        # the guardrails intervention is a BaseException, so it has to be caught explicitly
+        except BaseException as e:
+            logger.error(traceback.format_exc())
+            try:
+                self._update(job, status="failed", error=repr(e))
+            except _LeaseLost:
+                pass
+        finally:
+            # unfinished jobs stay held, so that `stop` releases them
+            if finished:
+                with self._held_lock:
+                    self._held.discard(job.id)
+
+    def _update(self, job: Job, status: JobStatus | None = None, results: list[LocationData] | None = None, error: str | None = None) -> None:
+        if status is not None:
+            job.status = status
+        if results is not None:
+            job.results = results
+        if error is not None:
+            job.error = error
+        job.version += 1
+        job.updated_at = time.time()
+        if not self.store.save(job, self.owner):
+            raise _LeaseLost(job.id)
+
+
+job_manager = JobManager(JobStore(os.path.join(settings.DATA_DIR, "jobs.sqlite3")), settings.JOB_WORKERS)
@@ -0,0 +1,174 @@
+import re
+
+from loguru import logger
+
+from app.types.merge import FieldChange, MergeResult
+from app.types.model_outputs import PreliminaryLocationData, TimeInterval
+from app.services.tools.structured_output import resolve_conflicts
+from app.services.utils import DAYS
+
+DESCRIPTION_LENGTH = (350, 400)     # the length of description requested from the LLM
+CONTACT_FORMAT = re.compile(r"^\+65-\d{4}-\d{4}$")
+
+
+def merge_location_data(current: PreliminaryLocationData, new: PreliminaryLocationData) -> MergeResult:
+    """
+    Merge newly extracted location data into the current data field by field. Empty fields are filled,
+    offerings and images are combined by name and url, and values that only differ in formatting or
+    completeness are settled by rules. The LLM is only called if some fields have genuinely different
+    values, and then only decides between the two values of each of those fields.
+
+    :param PreliminaryLocationData current: The current location data
+    :param PreliminaryLocationData new: The newly extracted location data
+    :return MergeResult: The merged data and the changes made to each field
+    """
+    merged = current.model_copy(deep=True)
+    changes: list[FieldChange] = []
+    # each conflict is the path of the field, both values and how to apply the new value
+    conflicts: list[tuple[str, str, str]] = []
+    setters = []
+
+    def merge_value(field: str, old: str, value: str, prefer_new, setter) -> None:
+        if not value.strip() or _normalize_text(old) == _normalize_text(value):
+            return
+        if not old.strip():
+            changes.append(FieldChange(field=field, old=old, new=value, action="filled"))
+        elif prefer_new is None:
+            conflicts.append((field, old, value))
+            setters.append(setter)
+            return
+        elif prefer_new:
+            changes.append(FieldChange(field=field, old=old, new=value, action="replaced"))
+        else:
+            return
+        setter(value)
+
+    merge_value("address", current.address, new.address, _prefer_new_address(current.address, new.address),
+                lambda v: setattr(merged, "address", v))
+    merge_value("contact", current.contact, new.contact, _prefer_new_contact(current.contact, new.contact),
+                lambda v: setattr(merged, "contact", v))
+    merge_value("description", current.description, new.description,
+                _prefer_new_description(current.description, new.description),
+                lambda v: setattr(merged, "description", v))
+
+    for day in DAYS:
+        old_interval: TimeInterval = getattr(current.opening_hours, day)
+        new_interval: TimeInterval = getattr(new.opening_hours, day)
+        combined = _combine_intervals(old_interval, new_interval)
+        merge_value(
+            f"opening_hours.{day}", _format_interval(old_interval), _format_interval(combined or new_interval),
+            True if combined else None,
+            lambda v, day=day: setattr(merged.opening_hours, day, _parse_interval(v)),
+        )
+
+    offerings = {_normalize_text(o.name): o for o in merged.offerings}
+    for offering in new.offerings:
+        existing = offerings.get(_normalize_text(offering.name))
+        if existing is None:
+            offerings[_normalize_text(offering.name)] = offering = offering.model_copy()
+            merged.offerings.append(offering)
+            changes.append(FieldChange(field=f"offerings[{offering.name}]", old="", new=offering.price, action="added"))
+        else:
+            merge_value(f"offerings[{existing.name}]", existing.price, offering.price, None,
+                        lambda v, existing=existing: setattr(existing, "price", v))
+
+    urls = {image.url for image in merged.images}
+    for image in new.images:
+        if image.url not in urls:
+            urls.add(image.url)
+            merged.images.append(image.model_copy())
+            changes.append(FieldChange(field=f"images[{image.name}]", old="", new=image.url, action="added"))
+
+    if conflicts:
+        choices = resolve_conflicts(current.name, conflicts)
+        for (field, old, value), setter, choice in zip(conflicts, setters, choices):
+            if choice == 2:
+                setter(value)
+                changes.append(FieldChange(field=field, old=old, new=value, action="replaced", source="llm"))
+    logger.debug(f"Merged {len(changes)} field(s) of {current.name} with {len(conflicts)} conflict(s)")
+    return MergeResult(location=merged, changes=changes, conflicts=len(conflicts), used_llm=bool(conflicts))
+
+
+def _prefer_new_address(old: str, new: str) -> bool | None:
+    """
+    An address whose words contain all the words of the other one, in the same order and next to each
+    other, is more complete. Words are compared whole, so that "1 Orchard Rd" is not mistaken for a part of
+    "11 Orchard Rd". Other differences, including any difference in a number, are conflicts.
+    """
+    old_words, new_words = _normalize_text(old).split(), _normalize_text(new).split()
+    if _contains_run(new_words, old_words):
+        return True
+    if _contains_run(old_words, new_words):
+        return False
+    return None
+
+
+def _contains_run(words: list[str], run: list[str]) -> bool:
+    """
+    Whether `run` is a contiguous sequence of `words`.
+    """
+    return any(words[i:i + len(run)] == run for i in range(len(words) - len(run) + 1))
+
+
+def _prefer_new_contact(old: str, new: str) -> bool | None:
+    """
+    Numbers with the same digits (or the same number with and without the country code) are the same
+    contact, and the one in the requested format is kept. Other differences are conflicts.
+    """
+    old_digits, new_digits = re.sub(r"\D", "", old), re.sub(r"\D", "", new)
+    if not old_digits or not new_digits or not (old_digits.endswith(new_digits) or new_digits.endswith(old_digits)):
+        return None
+    if CONTACT_FORMAT.match(old):
+        return False
+    return bool(CONTACT_FORMAT.match(new)) or len(new_digits) > len(old_digits)
+
+
+def _prefer_new_description(old: str, new: str) -> bool:
+    """
+    Descriptions are free text rather than facts, so the one closest to the requested length is kept.
+    """
+    def distance(text: str) -> int:
+        length = len(text.strip())
+        return max(DESCRIPTION_LENGTH[0] - length, length - DESCRIPTION_LENGTH[1], 0)
+    return distance(new) < distance(old)
+
+
+def _combine_intervals(old: TimeInterval, new: TimeInterval) -> TimeInterval | None:
+    """
+    Combine the known halves of two intervals, e.g. an interval with only a start and another one with 
+    only an end. Intervals that both know the start or the end, with different times, are conflicts.
+
+    :return TimeInterval | None: The combined interval, or None if the intervals conflict
+    """
+    old_start, old_end = _normalize_time(old.start), _normalize_time(old.end)
+    new_start, new_end = _normalize_time(new.start), _normalize_time(new.end)
+    if old_start and new_start and old_start != new_start or old_end and new_end and old_end != new_end:
+        return None
+    return TimeInterval(start=old.start if old_start else new.start, end=old.end if old_end else new.end)
+
+
+def _format_interval(interval: TimeInterval) -> str:
+    if not interval.start and not interval.end:
+        return ""
+    return f"{interval.start}-{interval.end}"
+
+
+def _parse_interval(value: str) -> TimeInterval:
+    start, _, end = value.partition("-")
+    return TimeInterval(start=start, end=end)
+
+
+def _normalize_time(value: str) -> str:
+    """
+    Normalize a time to HH:MM, e.g. "9:00" and "0900" become "09:00".
+    """
+    digits = re.findall(r"\d+", value)
+    if len(digits) == 1 and len(digits[0]) in (3, 4):
+        digits = [digits[0][:-2], digits[0][-2:]]
+    if len(digits) != 2:
+        return value.strip()
+    return f"{int(digits[0]):02d}:{int(digits[1]):02d}"
+
+
+def _normalize_text(value: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", value.casefold()).split())
@@ -4,6 +4,11 @@ import json
 from loguru import logger
 from app.types.model_outputs import PreliminaryLocationData
 
+# a string (possibly cut off), a fence, a bracket or comma, or a run of any other characters
+JSON_TOKEN = re.compile(r'"(?:[^"\\]|\\.)*"?|```|[{}\[\],]|[^"{}\[\],`]+|`', re.DOTALL)
+CLOSING_BRACKETS = {"{": "}", "[": "]"}
+_INVALID = object()
+
 
 def parse_string_list(input: str) -> list[str]:
     """
@@ -12,11 +17,7 @@ def parse_string_list(input: str) -> list[str]:
     :param str input: The raw input string
     :return: The extracted list of strings
     """
-    queries = _parse_json_in_backticks(input)
-    # if unable to retrieve items in backticks
-    if not queries or type(queries) != list:
-        logger.warning("No valid JSON object found within backticks, looking for JSON object outside of backticks")
-        queries = _parse_json_list(input)
+    queries = _scan_json(input, "[")
     if not queries:
         return []
     
@@ -28,6 +29,28 @@ def parse_string_list(input: str) -> list[str]:
     return results
 
 
+def parse_choice_list(input: str, n_choices: int) -> list[int]:
+    """
+    Parse the input string as a list of choices between a first (1) and a second (2) value. Missing or
+    invalid choices default to the first value.
+
+    :param str input: The raw input string
+    :param int n_choices: The number of choices expected
+    :return: The list of `n_choices` choices
+    """
+    choices = _scan_json(input, "[")
+    if not choices:
+        choices = []
+
+    results = []
+    for i in range(n_choices):
+        try:
+            results.append(2 if int(choices[i]) == 2 else 1)
+        except: 
+            results.append(1)
+    return results
+
+
 def parse_preliminary_location(input: str) -> PreliminaryLocationData | None:
     """
     Parse the preliminary location data into a formatted string.
@@ -36,13 +59,67 @@ def parse_preliminary_location(input: str) -> PreliminaryLocationData | None:
     :return: The formatted preliminary location data.
     """
     # Parse as json
-    location = _parse_json_in_backticks(input)
-    if not location or type(location) != dict:
-        location = _parse_json_dict(input)
+    location = _scan_json(input, "{")
     logger.trace(location)
     if not location:
         return None
+    return _to_preliminary_location(location)
+
+
+def parse_preliminary_location_list(input: str) -> list[PreliminaryLocationData]:
+    """
+    Parse the input string as a list of preliminary location data.
+
+    :param str input: The raw input string
+    :return list[PreliminaryLocationData]: The locations that could be parsed
+    """
+    locations = _scan_json(input, "[")
+    logger.trace(locations)
+    if not locations:
+        return []
+    return [_to_preliminary_location(location) for location in locations if type(location) == dict]
+
+
+def parse_image_details(input: str) -> tuple[str, list[str]]:
+    """
+    Parse the image details from the raw input string. Returns a tuple containing the caption
+    and the list of hashtags.
+
+    :param str input: The input string to be parsed
+
+    :return tuple[str, list[str]]: The caption and list of hashtags extracted.
+    """
+    # Parse as json
+    details = _scan_json(input, "{")
+    logger.trace(details)
+    if not details:
+        return "", []
+    
+    caption = details.get("caption", "")
+    try:
+        assert type(caption) == str
+    except:
+        caption = ""
+    hashtags = details.get("hashtags", [])
+    parsed_hashtags = []
+    try:
+        assert type(hashtags) == list
+        for h in hashtags:
+            if type(h) == str:
+                parsed_hashtags.append(h)
+    except:
+        parsed_hashtags = []
+    
+    return caption, parsed_hashtags
+
+
+def _to_preliminary_location(location: dict[str, Any]) -> PreliminaryLocationData:
+    """
+    Validate a parsed JSON object field by field, replacing missing or invalid fields with empty values.
 
+    :param dict[str, Any] location: The parsed JSON object
+    :return PreliminaryLocationData: The validated location data
+    """
     # Validate the json object 
     # check basic string fields
     try:
@@ -138,103 +215,109 @@ def parse_preliminary_location(input: str) -> PreliminaryLocationData | None:
     )
 
 
-def parse_image_details(input: str) -> tuple[str, list[str]]:
+def _scan_json(string: str, openings: str = "{[") -> Any | None:
     """
-    Parse the image details from the raw input string. Returns a tuple containing the caption
-    and the list of hashtags.
-
-    :param str input: The input string to be parsed
+    Find and parse the first JSON value in an input string that starts with one of the `openings` 
+    brackets, in a single pass over the string. Text around the value is ignored, and the value is 
+    repaired if it has trailing commas or is cut off (by the end of the output or by a closing fence).
+    The content of a ```json fence is preferred over the text before it.
 
-    :return tuple[str, list[str]]: The caption and list of hashtags extracted.
+    :params str string: The input string
+    :params str openings: The brackets the value may start with, `{` for objects and `[` for lists
+    :returns Any | None: The parsed JSON value. If no valid values are found, return None.
     """
-    # Parse as json
-    details = _parse_json_in_backticks(input)
-    if not details or type(details) != dict:
-        details = _parse_json_dict(input)
-    logger.trace(details)
-    if not details:
-        return "", []
-    
-    caption = details.get("caption", "")
-    try:
-        assert type(caption) == str
-    except:
-        caption = ""
-    hashtags = details.get("hashtags", [])
-    parsed_hashtags = []
-    try:
-        assert type(hashtags) == list
-        for h in hashtags:
-            if type(h) == str:
-                parsed_hashtags.append(h)
-    except:
-        parsed_hashtags = []
-    
-    return caption, parsed_hashtags
+    fence = string.find("```json")
+    sections = [(fence + len("```json"), len(string)), (0, fence)] if fence != -1 else [(0, len(string))]
+    start_pattern = re.compile("[" + re.escape(openings) + "]")
+    for position, end in sections:
+        while True:
+            match = start_pattern.search(string, position, end)
+            if not match:
+                break
+            value, position = _scan_value(string, match.start())
+            if value is not _INVALID:
+                return value
+    logger.warning("No valid JSON object found")
+    return None
 
 
-def _parse_json_in_backticks(string: str) -> Any | None:
+def _scan_value(string: str, start: int) -> tuple[Any, int]:
     """
-    Parse an input string and retrieve the JSON object enclosed in backticks.
+    Parse the JSON value that starts with the bracket at `start`, balancing brackets and removing trailing 
+    commas on the way. If the value is cut off, open brackets are closed, falling back to the last complete 
+    element if the value is still invalid. Elements that are cut off in the middle of a string are dropped.
 
     :params str string: The input string
-    :returns Any | None: The parsed JSON object. If no valid objects are found, return None.
+    :params int start: The position of the opening bracket
+    :returns tuple[Any, int]: The parsed value (or `_INVALID`) and the position to continue scanning from
     """
-    # attempt to parse string with both opening and closing backticks first
-    match = re.search(r"\`\`\`json(.+?)\`\`\`", string, re.DOTALL)
-    if not match:
-        # attempt to parse string with only the closing backticks
-        match = re.search(r"(.+)\`\`\`", string, re.DOTALL)
-    if not match:
-        return None
-    try:
-        raw_json = match.group(1).strip(" \n")
-        return json.loads(raw_json)
-    except:
-        # for some reason LLM likes to return JSON object with an extra comma at the end
-        try:
-            logger.debug("Attempt json parsing with one less comma")
-            removed_last_comma = "".join(list(reversed(list(reversed(raw_json)).remove(","))))
-            return json.loads(removed_last_comma)
-        except:
-            logger.warning("Invalid JSON object found")
-            return None
-        
+    out: list[str] = []
+    stack: list[str] = []
+    last = -1       # the position in `out` of the last token that is not whitespace
+    checkpoint = None   # the output and open brackets up to the last complete element
+    position = start
+    for token in JSON_TOKEN.finditer(string, start):
+        text = token.group()
+        position = token.end()
+        if text in CLOSING_BRACKETS:
+            stack.append(text)
+            out.append(text)
+            checkpoint = (len(out), stack.copy())
+        elif text in ("}", "]"):
+            if not stack or CLOSING_BRACKETS[stack.pop()] != text:
+                return _INVALID, position
+            if last != -1 and out[last] == ",":
+                out[last] = ""
+            out.append(text)
+            if not stack:
+                return _loads("".join(out)), position
+        elif text == ",":
+            checkpoint = (len(out), stack.copy())
+            out.append(text)
+        elif text == "```":
+            break
+        elif text.startswith('"') and (len(text) == 1 or not text.endswith('"') or _escaped(text)):
+            # a cut off string is dropped, as a partial url, number or time is worse than none
+            out = out[:checkpoint[0]] if checkpoint else []
+            stack = checkpoint[1] if checkpoint else []
+            break
+        else:
+            out.append(text)
+            if text.isspace():
+                continue
+        last = len(out) - 1
 
-def _parse_json_list(string: str) -> list[Any] | None:
-    """
-    Parse an input string and retrieve the JSON list.
+    # the value was cut off
+    logger.debug("Attempt to close a truncated JSON value")
+    value = _loads(_close(out, stack)) if out else _INVALID
+    if value is _INVALID and checkpoint:
+        length, open_brackets = checkpoint
+        value = _loads(_close(out[:length], open_brackets))
+    return value, len(string) if value is _INVALID else position
 
-    :params str string: The input string
-    :returns list[Any] | None: The parsed JSON list. If no valid objects are found, return None.
-    """
-    match = re.search(r"(\[.+\])", string, re.DOTALL)
-    if not match: 
-        return None
-    try:
-        raw_json = match.group(1).strip(" \n")
-        return json.loads(raw_json)
-    except:
-        logger.warning("Invalid JSON object found")
-        return None
-        
 
-def _parse_json_dict(string: str) -> dict[str, Any] | None:
+def _close(out: list[str], stack: list[str]) -> str:
     """
-    Parse an input string and retrieve the JSON object.
+    Close the open brackets of a truncated value, removing a dangling comma.
+    """
+    raw_json = "".join(out).rstrip()
+    if raw_json.endswith(","):
+        raw_json = raw_json[:-1]
+    return raw_json + "".join(CLOSING_BRACKETS[bracket] for bracket in reversed(stack))
 
-    :params str string: The input string
-    :returns dict[str, Any] | None: The parsed JSON object. If no valid objects are found, return None.
+
+def _escaped(token: str) -> bool:
     """
-    match = re.search(r"(\{.+\})", string, re.DOTALL)
-    if not match: 
-        return None
+    Whether the closing quote of a string token is escaped, i.e. the string is not terminated.
+    """
+    return (len(token) - len(token[:-1].rstrip("\\")) - 1) % 2 == 1
+
+
+def _loads(raw_json: str) -> Any:
     try:
-        raw_json = match.group(1).strip(" \n")
-        return json.loads(raw_json)
-    except:
-        logger.warning("Invalid JSON object found")
-        return None
+        return json.loads(raw_json, strict=False)
+    except ValueError:
+        return _INVALID
 
 
 def _validate_url(string: str) -> bool:
@@ -16,6 +16,8 @@ You are an expert researcher who has been tasked to find detailed information on
 Currently you have gathered the following information:
 {information}
 
+The following information is still missing: {missing}
+
 Return a list of Google search queries that you think will help to fill the missing information. DO NOT attempt to fill in the missing information yourself. Return the search queries as list of string.
 
 Search queries:
@@ -32,16 +34,23 @@ Extract ONLY information relevant to "{name}" from this document:
 """.strip(" \n")
 
 
-COMPARE_INFORMATION_PROMPT = """
-Combine the following documents into a single new document by retaining the most relevant fields from each document.
+BATCH_INFORMATION_PROMPT = """
+Extract ONLY information relevant to each of these locations from this document:
+{names}
+
+{text}
+
+Return a list with one JSON object for each location, using the name of the location exactly as given above.
+
+```json
+""".strip(" \n")
+
 
-Document 1:
-{document_1}
+RESOLVE_CONFLICTS_PROMPT = """
+Two documents disagree on some details of "{name}". For each numbered detail below, decide which value is more likely to be correct and up to date. Return a list with one number per detail, using 1 to keep the first value or 2 to use the second value.
 
-Document 2:
-{document_2}
+{conflicts}
 
-New Document:
 ```json
 """.strip(" \n")
 
@@ -0,0 +1,158 @@
+import math
+import re
+from collections import Counter
+from functools import lru_cache
+from typing import Callable
+
+import tiktoken
+from loguru import logger
+
+from app.core.config import settings
+from app.core.rate_limit import estimate_tokens
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+# the maximum size of a block, so that long sections can be selected in parts
+MAX_BLOCK_TOKENS = 256
+
+IMAGE_LINE = re.compile(r"^<img\b")
+HEADING_LINE = re.compile(r"^#{1,6} ")
+WORD = re.compile(r"\w+")
+
+
+class _Block:
+    """
+    Consecutive lines of a page under the same heading, including the images among them.
+    """
+    __slots__ = ("position", "section", "heading", "continued", "lines", "tokens", "score")
+
+    def __init__(self, position: int, section: int, heading: str, continued: bool):
+        self.position = position
+        self.section = section
+        self.heading = heading
+        self.continued = continued  # whether the heading of the section is in an earlier block
+        self.lines: list[str] = []
+        self.tokens = 0
+        self.score = 0.0
+
+    def text(self) -> str:
+        """
+        The text the block is ranked on, which includes its heading.
+        """
+        lines = [line for line in self.lines if not IMAGE_LINE.match(line)]
+        return "\n".join([self.heading, *lines] if self.continued else lines)
+
+    def render(self, with_heading: bool = False) -> str:
+        return "\n".join([self.heading, *self.lines] if with_heading else self.lines)
+
+
+def select_content(markdown: str, query: str | None = None, max_tokens: int = settings.PAGE_CONTENT_MAX_TOKENS) -> str:
+    """
+    Select the parts of a page that are most relevant to the query and fit in a token budget. The page
+    is split into blocks of the lines under each heading (up to `MAX_BLOCK_TOKENS` tokens each), which are 
+    ranked against the query with BM25, so that details such as the address or opening hours of a venue 
+    are kept together with the heading that names it. Images are kept in the same block as the text that 
+    precedes them. The selected blocks are returned in their original order, and a block that continues 
+    a section is preceded by the heading of the section if the start of the section was not selected.
+
+    :param str markdown: The content of the page in Markdown, as returned by the parser of the scraper
+    :param str query: The query or location name to rank the blocks against. Without a query, the
+    blocks are selected in order from the top of the page.
+    :param int max_tokens: The maximum number of tokens of the selected content
+    :return str: The selected content in Markdown
+    """
+    count_tokens = _get_token_counter()
+    blocks = _split_blocks(markdown, count_tokens)
+    if not blocks:
+        return ""
+
+    terms = _tokenize(query) if query else []
+    if terms:
+        _score_blocks(blocks, set(terms))
+    # blocks of equal score (e.g. without any query term) are taken from the top of the page
+    ranked = sorted(blocks, key=lambda b: (-b.score, b.position))
+
+    selected: list[_Block] = []
+    budget = max_tokens
+    for block in ranked:
+        if block.tokens <= budget:
+            selected.append(block)
+            budget -= block.tokens
+        if budget <= 0:
+            break
+    selected.sort(key=lambda b: b.position)
+    logger.trace(f"Selected {len(selected)} of {len(blocks)} blocks ({max_tokens - budget} tokens)")
+    sections = set()    # the sections whose heading is already in the output
+    parts = []
+    for block in selected:
+        parts.append(block.render(with_heading=block.continued and block.section not in sections))
+        sections.add(block.section)
+    return "\n".join(parts)
+
+
+def _split_blocks(markdown: str, count_tokens: Callable[[str], int]) -> list[_Block]:
+    """
+    Split the page into blocks of the lines under each heading, starting a new block whenever a block 
+    would grow beyond `MAX_BLOCK_TOKENS`. Images always stay in the block of the text before them. The 
+    tokens of each block include the heading it may be rendered with.
+    """
+    blocks: list[_Block] = []
+    section = 0
+    heading = ""
+    heading_tokens = 0
+    for line in markdown.split("\n"):
+        if not line.strip():
+            continue
+        tokens = count_tokens(line) + 1     # count the newline that separates lines
+        if HEADING_LINE.match(line):
+            section += 1
+            heading, heading_tokens = line, tokens
+            blocks.append(_Block(len(blocks), section, heading, continued=False))
+        elif not blocks or (blocks[-1].tokens + tokens > MAX_BLOCK_TOKENS and not IMAGE_LINE.match(line)):
+            continued = bool(blocks) and bool(heading)
+            blocks.append(_Block(len(blocks), section, heading, continued))
+            blocks[-1].tokens += heading_tokens if continued else 0
+        blocks[-1].lines.append(line)
+        blocks[-1].tokens += tokens
+    return blocks
+
+
+def _score_blocks(blocks: list[_Block], terms: set[str]) -> None:
+    """
+    Score every block against the query terms with BM25, treating each block (with its heading) as a
+    document of the page.
+    """
+    documents = [Counter(_tokenize(block.text())) for block in blocks]
+    average_length = sum(d.total() for d in documents) / len(documents) or 1
+    frequencies = Counter(term for d in documents for term in terms if term in d)
+    idf = {
+        term: math.log(1 + (len(documents) - frequencies[term] + 0.5) / (frequencies[term] + 0.5))
+        for term in terms
+    }
+    for block, document in zip(blocks, documents):
+        length = document.total()
+        score = 0.0
+        for term in terms:
+            tf = document[term]
+            if tf:
+                score += idf[term] * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / average_length))
+        block.score = score
+
+
+def _tokenize(text: str) -> list[str]:
+    return WORD.findall(text.casefold())
+
+
+@lru_cache
+def _get_token_counter() -> Callable[[str], int]:
+    """
+    Return a function counting the tokens of a piece of text. Falls back to a rough estimate if the
+    tiktoken encoding cannot be loaded (it is downloaded on first use).
+    """
+    try:
+        encoding = tiktoken.get_encoding(settings.PAGE_CONTENT_ENCODING)
+    except Exception as e:
+        logger.warning(f"Failed to load the {settings.PAGE_CONTENT_ENCODING} encoding, estimating token counts instead: {e}")
+        return estimate_tokens
+    return lambda text: len(encoding.encode_ordinary(text))
@@ -1,16 +1,25 @@
 import base64
-import os
+import io
 import subprocess
 import requests
 
 from langchain_core.messages import HumanMessage
+from PIL import Image
 from loguru import logger
 
+from app.core.singleflight import SingleFlight
 from app.dependencies.multimodal_llm import multimodal_llm
 from app.services.prompts import IMAGE_CAPTION_PROMPT, STRUCTURED_RESPONSE_SYSTEM_PROMPT
 from app.services.parser import parse_image_details
 from app.types.model_json_schema import IMAGE_DETAILS_JSON_SCHEMA
 
+DOWNLOAD_TIMEOUT = 10
+FFMPEG_TIMEOUT = 30
+PNG_COMPRESS_LEVEL = 1  # favour encoding speed over file size
+PNG_MODES = {"1", "L", "LA", "P", "RGB", "RGBA", "I", "I;16"}    # image modes that can be written as PNG as is
+
+caption_flight = SingleFlight("caption")
+
 def generate_caption_hashtags(image_url: str) -> tuple[str, list[str]]:
     """
     Use a multimodal LLM to generate caption and hashtags for the provided image.
@@ -18,16 +27,21 @@ def generate_caption_hashtags(image_url: str) -> tuple[str, list[str]]:
     :param str image_url: The url of the image
     :return tuple[str, list[str]]: A tuple containing the caption and hashtags
     """
+    # concurrent requests captioning the same image share a single download and generation
+    return caption_flight.do(image_url, _generate_caption_hashtags, image_url)
+
+
+def _generate_caption_hashtags(image_url: str) -> tuple[str, list[str]]:
+    """
+    Download an image and generate its caption and hashtags.
+    """
     # retrieve image
-    r = requests.get(image_url)
-    try:
-        r.raise_for_status()
-    except:
-        logger.error(f"Unable to retrieve image data from url {image_url}")
+    image_bytes = _download_image(image_url)
+    if not image_bytes:
         return "", []
 
     # convert to PNG and encode as base64
-    image_base64 = _generate_base64_from_url(image_url)
+    image_base64 = _generate_base64_from_bytes(image_bytes)
     if not image_base64:
         return "", []
 
@@ -43,45 +57,83 @@ def generate_caption_hashtags(image_url: str) -> tuple[str, list[str]]:
     return caption, hashtags
 
 
-def _generate_base64_from_url(url: str) -> str:
+def _download_image(url: str) -> bytes:
     """
-    Attempts to retrieve an image from any url and encode as PNG. Returns the base64 representation of the image.
+    Download the raw bytes of an image.
 
     :param str url: The url of the image
-    :return str: The base64 string
+    :return bytes: The image data, or empty bytes if the image could not be retrieved
     """
-    # retrieve image
-    r = requests.get(url)
     try:
+        r = requests.get(url, timeout=DOWNLOAD_TIMEOUT)
         r.raise_for_status()
     except:
         logger.error(f"Unable to retrieve image data from url {url}")
+        return b""
+    return r.content
+
+
+def _generate_base64_from_bytes(content: bytes) -> str:
+    """
+    Encode a downloaded image as PNG entirely in memory. Returns the base64 representation of the image.
+
+    :param bytes content: The raw image data
+    :return str: The base64 string
+    """
+    png = _transcode_with_pillow(content)
+    if png is None:
+        # fall back to ffmpeg for formats that Pillow cannot decode
+        png = _transcode_with_ffmpeg(content)
+    if not png:
         return ""
-    
-    # write to local temporary file
-    if not os.path.exists("temp"):
-        os.mkdir("temp")
-    image_name = url.split("/")[-1]
-    file_name = os.path.join("temp", image_name)
-    with open(file_name, "wb") as f:
-        f.write(r.content)
-
-    # use ffmpeg to convert to standard png format
-    output_name = os.path.splitext(file_name)[0] + "-temp.png"
+    return base64.b64encode(png).decode("ascii")
+
+
+def _transcode_with_pillow(content: bytes) -> bytes | None:
+    """
+    Convert an image to PNG with Pillow.
+
+    :param bytes content: The raw image data
+    :return bytes | None: The PNG data, or None if Pillow does not support the image format
+    """
     try:
-        subprocess.check_call([
-            "ffmpeg", "-y",
-            "-i", file_name,
-            output_name
-        ])
-        os.remove(file_name)
-    except subprocess.CalledProcessError as e:
+        with Image.open(io.BytesIO(content)) as image:
+            if image.format == "PNG":
+                return content
+            image.seek(0)   # only the first frame of animated images is used
+            if image.mode not in PNG_MODES:
+                has_alpha = "A" in image.getbands() or "transparency" in image.info
+                image = image.convert("RGBA" if has_alpha else "RGB")
+            output = io.BytesIO()
+            image.save(output, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+            return output.getvalue()
+    except Exception as e:
+        logger.debug(f"Failed to convert image with Pillow: {e}")
+        return None
+
+
+def _transcode_with_ffmpeg(content: bytes) -> bytes:
+    """
+    Convert an image to PNG by piping it through ffmpeg, without touching the filesystem.
+
+    :param bytes content: The raw image data
+    :return bytes: The PNG data, or empty bytes if the conversion failed
+    """
+    try:
+        result = subprocess.run(
+            [
+                "ffmpeg", "-loglevel", "error",
+                "-i", "pipe:0",
+                "-frames:v", "1",
+                "-c:v", "png", "-f", "image2pipe",
+                "pipe:1"
+            ],
+            input=content,
+            capture_output=True,
+            timeout=FFMPEG_TIMEOUT,
+            check=True
+        )
+    except (OSError, subprocess.SubprocessError) as e:
         logger.warning(f"Failed to convert file with ffmpeg : {e}")
-        os.remove(file_name)
-        return ""
-    
-    # encode image as base64 string
-    with open(output_name, "rb") as f:
-        image_base64 = base64.b64encode(f.read()).decode("ascii")
-    os.remove(output_name)
-    return image_base64
\ No newline at end of file
+        return b""
+    return result.stdout
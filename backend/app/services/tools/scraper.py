@@ -1,92 +1,518 @@
+import asyncio
+import re
+import threading
+from collections import Counter
+from concurrent.futures import as_completed
+from html.parser import HTMLParser
+from typing import Iterator
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
 from loguru import logger
-import bs4
-from bs4._typing import _OneElement
-from playwright.sync_api import sync_playwright
+from bs4.dammit import EntitySubstitution
+
+from app.core.config import settings
+from app.core.singleflight import SingleFlight
+from app.dependencies.browser import browser_pool
+from app.dependencies.cache import create_cache
+from app.dependencies.http_client import fetch_html
+from app.services.tools.content_selector import select_content
+from app.types.stats import ScraperStats
+
+TRACKING_PARAM_PREFIXES = ("utm_", "fbclid", "gclid", "mc_cid", "mc_eid")
+MAX_MARKDOWN_LENGTH = 100000   # the content selector picks what is given to the LLM from these characters
+
+# how BeautifulSoup's html tree builder treats elements and strings, which `_parse_html` reproduces
+ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+VOID_ELEMENTS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "keygen", "link", "menuitem", "meta", "param", 
+    "source", "track", "wbr", "basefont", "bgsound", "command", "frame", "image", "isindex", "nextid", "spacer",
+}
+PRESERVE_WHITESPACE_TAGS = {"pre", "textarea"}
+STRING_CONTAINERS = {"rt", "rp", "style", "script", "template"}
+SPECIAL_STRING_FORMATS = {
+    "comment": "<!--{}-->",
+    "cdata": "<![CDATA[{}]]>",
+    "doctype": "<!DOCTYPE {}>\n",
+    "declaration": "<?{}?>",
+    "pi": "<?{}>",
+}
+TEXT_PREFIXES = {"li": "- ", "h1": "# ", "h2": "## ", "h3": "### ", "h4": "#### "}
+
+# pages are downloaded with plain HTTP first, and only rendered with the browser if that is not enough
+HTTP_TIER = "http"
+BROWSER_TIER = "browser"
+IMAGE_TAG = re.compile(r"<img\b[^>]*>")
+JS_GATED_PATTERN = re.compile(
+    r"enable javascript|javascript is (?:required|disabled)|requires javascript|<div id=\"(?:root|app|__next)\"></div>"
+    r"|<title>just a moment\.\.\.</title>|cf-browser-verification",
+    re.IGNORECASE,
+)
+
+scrape_cache = create_cache(
+    "scrape_cache", settings.SCRAPE_CACHE_BACKEND, settings.SCRAPE_CACHE_TTL, settings.SCRAPE_CACHE_MAX_SIZE
+)
+scrape_flight = SingleFlight("scrape")
+# the tier that worked for each domain
+fetch_tier_cache = create_cache(
+    "fetch_tier_cache", settings.FETCH_TIER_CACHE_BACKEND, settings.FETCH_TIER_CACHE_TTL, settings.FETCH_TIER_CACHE_MAX_SIZE
+)
+
+_stats_lock = threading.Lock()
+_http_fetches = 0
+_browser_fetches = 0
+_browser_fallbacks = 0
 
-def scrape(url: str) -> str:
+def scrape(url: str, query: str | None = None) -> str:
     """
-    Call to scrape the contents of a web page. Retrieves only textual elements and images.
+    Call to scrape the contents of a web page. Retrieves only textual elements and images, keeping 
+    the parts of the page most relevant to the query that fit in the token budget of the LLM.
 
     :param str url: The URL of the web page to scrape.
+    :param str query: The query or location name that the content is selected for. Without a query, 
+    the content is taken from the top of the page.
     :return str: The content of the web page rendered in Markdown.
     """
-    # scrape using Playwright
-    content = _playwright_scrape(url)
+    key = normalize_url(url)
+    markdown = scrape_cache.get(key)
+    if markdown is None:
+        # concurrent scrapes of the same page (e.g. from different requests) share a single page load
+        markdown = scrape_flight.do(key, _scrape_uncached, key, url)
+    return select_content(markdown, query)
+
+
+async def scrape_async(url: str, query: str | None = None) -> str:
+    """
+    Asynchronous version of `scrape`. Must be awaited on the event loop of the browser pool.
+
+    :param str url: The URL of the web page to scrape.
+    :param str query: The query or location name that the content is selected for.
+    :return str: The content of the web page rendered in Markdown.
+    """
+    # the cache and the parser are blocking, so keep them off the event loop shared by all page loads
+    key = normalize_url(url)
+    markdown = await asyncio.to_thread(scrape_cache.get, key)
+    if markdown is None:
+        markdown = await scrape_flight.do_async(key, _scrape_uncached_async, key, url)
+    return await asyncio.to_thread(select_content, markdown, query)
+
+
+def normalize_url(url: str) -> str:
+    """
+    Normalize a URL so that trivially different URLs of the same page map to the same key. The scheme and 
+    host are lowercased, default ports, fragments and tracking parameters are dropped, and the remaining 
+    query parameters are sorted.
+
+    :param str url: The URL to normalize
+    :return str: The normalized URL
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or "").lower()
+    if parts.port and (scheme, parts.port) not in (("http", 80), ("https", 443)):
+        netloc += f":{parts.port}"
+    path = parts.path.rstrip("/") or "/"
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith(TRACKING_PARAM_PREFIXES)
+    )
+    return urlunsplit((scheme, netloc, path, urlencode(query), ""))
+
+
+def scrape_concurrently(
+    urls: list[str], max_concurrency: int = settings.SCRAPE_CONCURRENCY, query: str | None = None
+) -> Iterator[tuple[str, str]]:
+    """
+    Scrape several web pages at once, yielding each page as soon as it has been scraped. At most 
+    `max_concurrency` pages are loaded at the same time. Closing the iterator early (e.g. breaking 
+    out of the loop) cancels the pages that have not been scraped yet.
+
+    :param list[str] urls: The URLs of the web pages to scrape.
+    :param int max_concurrency: The maximum number of pages loaded concurrently.
+    :param str query: The query that the content of each page is selected for.
+    :return Iterator[tuple[str, str]]: Tuples of URL and page content in Markdown, in order of completion.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def bounded_scrape(url: str) -> str:
+        async with semaphore:
+            return await scrape_async(url, query)
 
-    # extract relevent content using BeautifulSoup
+    futures = {asyncio.run_coroutine_threadsafe(bounded_scrape(url), browser_pool.loop): url for url in urls}
+    try:
+        for future in as_completed(futures):
+            try:
+                content = future.result()
+            except Exception as e:
+                logger.error(f"Failed to scrape {futures[future]}: {e}")
+                content = ""
+            yield futures[future], content
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def _parse_and_cache(key: str, content: str) -> str:
+    """
+    Convert the raw html of a page into Markdown and cache the result under the given key.
+    """
+    # extract relevent content, stopping at a length that bounds the cost of parsing very large pages
     # we retain images in markup since the positions of embedded images are important
-    html_content = _parse_html(content)
+    markdown = _parse_html(content, max_length=MAX_MARKDOWN_LENGTH)
+    if markdown:    # failed scrapes are not cached so that they can be retried
+        scrape_cache.set(key, markdown)
+    return markdown
+
+
+def scraper_stats() -> ScraperStats:
+    """
+    Return a snapshot of how pages were fetched.
+    """
+    with _stats_lock:
+        return ScraperStats(
+            http_first=settings.SCRAPE_HTTP_FIRST,
+            http_fetches=_http_fetches,
+            browser_fetches=_browser_fetches,
+            browser_fallbacks=_browser_fallbacks,
+        )
+
+
+def _scrape_uncached(key: str, url: str) -> str:
+    """
+    Scrape a page that is not in the cache, trying a plain download first and using Playwright only if 
+    the page needs it.
+    """
+    markdown = _http_scrape(key, url)
+    if markdown is None:
+        content = _playwright_scrape(url)
+        markdown = _parse_and_cache(key, content)
+    return markdown
+
+
+async def _scrape_uncached_async(key: str, url: str) -> str:
+    """
+    Asynchronous version of `_scrape_uncached`.
+    """
+    markdown = await asyncio.to_thread(_http_scrape, key, url)
+    if markdown is None:
+        content = await browser_pool.fetch_async(url)
+        _record_browser_fetch()
+        markdown = await asyncio.to_thread(_parse_and_cache, key, content)
+    return markdown
+
+
+def _http_scrape(key: str, url: str) -> str | None:
+    """
+    Scrape a page with a plain HTTP request and cache the result, unless its domain is known to need the 
+    browser. Returns None if the page has to be rendered by the browser instead. The outcome is remembered 
+    for the domain of the page only if the page was downloaded, since failed downloads (timeouts, error 
+    statuses, content that is not html) are usually transient or specific to the page.
+    """
+    global _http_fetches, _browser_fallbacks
+    domain = urlsplit(url).hostname or ""
+    if not settings.SCRAPE_HTTP_FIRST or fetch_tier_cache.get(domain) == BROWSER_TIER:
+        return None
+    content = fetch_html(url)
+    if not content:
+        logger.debug(f"Failed to download {url}, falling back to the browser for this page only")
+        with _stats_lock:
+            _browser_fallbacks += 1
+        return None
+    markdown = _parse_html(content, max_length=MAX_MARKDOWN_LENGTH)
+    if _needs_browser(content, markdown):
+        logger.debug(f"Falling back to the browser for {url}")
+        fetch_tier_cache.set(domain, BROWSER_TIER)
+        with _stats_lock:
+            _browser_fallbacks += 1
+        return None
+    fetch_tier_cache.set(domain, HTTP_TIER)
+    scrape_cache.set(key, markdown)
+    with _stats_lock:
+        _http_fetches += 1
+    return markdown
+
+
+def _needs_browser(content: str, markdown: str) -> bool:
+    """
+    Check whether a page downloaded without rendering is missing its content, i.e. it has too little text
+    (in total or relative to the size of its html), or it asks for JavaScript to be enabled and has little text.
+    """
+    text_length = len(IMAGE_TAG.sub("", markdown))
+    if text_length < settings.SCRAPE_MIN_TEXT_LENGTH:
+        return True
+    if text_length / len(content) < settings.SCRAPE_MIN_TEXT_DENSITY:
+        return True
+    return JS_GATED_PATTERN.search(content) is not None and text_length < 2 * settings.SCRAPE_MIN_TEXT_LENGTH
+
 
-    # return only the first 10k tokens of the page content
-    trunc_content = html_content[:10000]
-    return trunc_content
+def _record_browser_fetch() -> None:
+    global _browser_fetches
+    with _stats_lock:
+        _browser_fetches += 1
 
 
 def _playwright_scrape(url: str) -> str:
     """
-    Scrape the contents of a page using the Playwright Sync API.
+    Scrape the contents of a page using a context borrowed from the shared browser pool.
     """
-    with sync_playwright() as playwright:
-        browser = playwright.chromium.launch(headless=True)
-        context = browser.new_context(user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3")
-        page = context.new_page()
-        try:
-            page.goto(url, wait_until='networkidle', timeout=3000)  # we wait at most 3 seconds for a page to render
-        except Exception as e:
-            logger.error(f"Error loading page: {e}") 
-        try:    # attempts to retrieve page contents regardless
-            content = page.content()
-        except Exception as e:
-            logger.error(f"Error retrieving page content: {e}") 
-            content = ""
-        browser.close()
-    return content
+    _record_browser_fetch()
+    return browser_pool.fetch(url)
 
 
-def _parse_html(content: str, text_tags: list[str] = ["p", "h1", "h2", "h3", "h4", "li"], image_tags: str = ["img"]) -> str:
+def _parse_html(
+    content: str, 
+    text_tags: list[str] = ["p", "h1", "h2", "h3", "h4", "li"], 
+    image_tags: list[str] = ["img"], 
+    max_length: int | None = None,
+) -> str:
     """
     Custom parser for html. Retrieves all text contents as text, but retains information
-    of embedded images in the page.
+    of embedded images in the page. The page is parsed in a single pass without building 
+    a tree, and parsing stops as soon as `max_length` characters of output are known.
 
     :param str content: The html content to be parsed
     :param list[str] text_tags: The list of tags to retrieve text from
     :param list[str] image_tags: The list of tags that will be treated as images
+    :param int max_length: The maximum length of the output, or None to parse the whole page
     """
-    soup = bs4.BeautifulSoup(content, "html.parser")
-    html_content = []
-    for element in soup.find_all():
-        if element.name in image_tags:
-            element = _recursively_remove_attrs(element, ["src"])
+    extractor = _MarkdownExtractor(text_tags, image_tags, max_length)
+    try:
+        extractor.feed(content)
+        extractor.close()
+        extractor.finish()
+    except _BudgetReached:
+        pass
+    markdown = "\n".join(extractor.parts).strip(" \n")
+    return markdown[:max_length] if max_length is not None else markdown
+
+
+class _BudgetReached(Exception): ...
+
+
+class _Element:
+    """
+    An open element. Only the elements of an image are kept after they are closed, since images are 
+    rendered back into html.
+    """
+    __slots__ = ("name", "attrs", "contents")
+
+    def __init__(self, name: str, attrs: dict[str, str] | None):
+        self.name = name
+        self.attrs = attrs
+        self.contents: list["_Element | tuple[str, str]"] = []
+
+
+class _MarkdownExtractor(HTMLParser):
+    """
+    Converts html into Markdown from the events of the standard library parser. It reproduces how 
+    BeautifulSoup's `html.parser` tree builder nests elements and normalizes strings, so the output is 
+    identical to extracting the text of the outermost text and image elements of the BeautifulSoup tree.
+    """
+    def __init__(self, text_tags: list[str], image_tags: list[str], max_length: int | None):
+        # character references are decoded by `handle_charref` and `handle_entityref`, like BeautifulSoup
+        super().__init__(convert_charrefs=False)
+        self.text_tags = text_tags
+        self.image_tags = image_tags
+        self.max_length = max_length
+        self.parts: list[str] = []
+        self._length = -1
+        self._stack: list[_Element] = []
+        self._open: Counter[str] = Counter()
+        self._preserve_whitespace: list[_Element] = []
+        self._string_containers: list[_Element] = []
+        self._closed_void_elements: list[str] = []
+        self._data: list[str] = []
+        # the outermost text or image element that is open, and the strings collected from it
+        self._capture: _Element | None = None
+        self._capture_is_image = False
+        self._capture_types: tuple[str, ...] = ()
+        self._strings: list[str] = []
+
+
+    def finish(self) -> None:
+        """
+        Close the elements that are still open at the end of the document.
+        """
+        self._end_data()
+        while self._stack:
+            self._pop()
+
+
+    def handle_startendtag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        self.handle_starttag(tag, attrs, handle_void_element=False)
+        self.handle_endtag(tag)
+
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]], handle_void_element: bool = True) -> None:
+        self._end_data()
+        capture = self._capture
+        keep_attrs = tag in self.image_tags if capture is None else self._capture_is_image
+        # duplicate attributes keep their last value
+        element = _Element(tag, {key: value or "" for key, value in attrs} if keep_attrs else None)
+        if capture is None:
+            if tag in self.image_tags:
+                self._start_capture(element, True)
+            elif tag in self.text_tags:
+                self._start_capture(element, False)
+        elif self._capture_is_image:
+            self._stack[-1].contents.append(element)
+
+        self._stack.append(element)
+        self._open[tag] += 1
+        if tag in PRESERVE_WHITESPACE_TAGS:
+            self._preserve_whitespace.append(element)
+        if tag in STRING_CONTAINERS:
+            self._string_containers.append(element)
+
+        if handle_void_element and tag in VOID_ELEMENTS:
+            self.handle_endtag(tag, check_already_closed=False)
+            self._closed_void_elements.append(tag)
+
+
+    def handle_endtag(self, tag: str, check_already_closed: bool = True) -> None:
+        # end tags of void elements that were closed right away are ignored, once
+        if check_already_closed and tag in self._closed_void_elements:
+            self._closed_void_elements.remove(tag)
+            return
+        self._end_data()
+        # close every element up to the most recent one with the same name, if there is one
+        while self._open[tag]:
+            if self._pop().name == tag:
+                break
+
+
+    def handle_data(self, data: str) -> None:
+        self._data.append(data)
+
+
+    def handle_charref(self, name: str) -> None:
+        if name[0] in "xX":
+            codepoint = int(name.lstrip(name[0]), 16)
+        else:
+            codepoint = int(name)
+        data = None
+        if codepoint < 256:
+            # references below 256 are often meant as Windows-1252 rather than unicode
+            try:
+                data = bytes([codepoint]).decode("windows-1252")
+            except UnicodeDecodeError:
+                pass
+        if not data:
+            try:
+                data = chr(codepoint)
+            except (ValueError, OverflowError):
+                pass
+        self._data.append(data or "\N{REPLACEMENT CHARACTER}")
+
+
+    def handle_entityref(self, name: str) -> None:
+        self._data.append(EntitySubstitution.HTML_ENTITY_TO_CHARACTER.get(name, "&" + name))
+
+
+    def handle_comment(self, data: str) -> None:
+        self._handle_special_string(data, "comment")
+
+
+    def handle_decl(self, decl: str) -> None:
+        self._handle_special_string(decl[len("DOCTYPE "):], "doctype")
+
+
+    def unknown_decl(self, data: str) -> None:
+        if data.upper().startswith("CDATA["):
+            self._handle_special_string(data[len("CDATA["):], "cdata")
+        else:
+            self._handle_special_string(data, "declaration")
+
+
+    def handle_pi(self, data: str) -> None:
+        self._handle_special_string(data, "pi")
+
+
+    def _handle_special_string(self, data: str, kind: str) -> None:
+        self._end_data()
+        self._data.append(data)
+        self._end_data(kind)
+
+
+    def _start_capture(self, element: _Element, is_image: bool) -> None:
+        self._capture = element
+        self._capture_is_image = is_image
+        self._capture_types = (element.name,) if element.name in STRING_CONTAINERS else ("text", "cdata")
+        self._strings = []
+
+
+    def _end_data(self, kind: str | None = None) -> None:
+        """
+        Turn the buffered data into a string of the given kind. Strings in a string container (e.g. a 
+        script) take the name of the container as their kind, and other strings are of kind "text".
+        """
+        if not self._data:
+            return
+        data = "".join(self._data)
+        self._data = []
+        if self._capture is None:
+            return
+        # strings of whitespace are collapsed into a single character outside of preformatted elements
+        if not self._preserve_whitespace and not data.strip(ASCII_SPACES):
+            data = "\n" if "\n" in data else " "
+        if kind is None:
+            kind = self._string_containers[-1].name if self._string_containers else "text"
+        if self._capture_is_image:
+            self._stack[-1].contents.append((kind, data))
+        elif kind in self._capture_types:
+            self._strings.append(data)
+
+
+    def _pop(self) -> _Element:
+        element = self._stack.pop()
+        self._open[element.name] -= 1
+        if self._preserve_whitespace and self._preserve_whitespace[-1] is element:
+            self._preserve_whitespace.pop()
+        if self._string_containers and self._string_containers[-1] is element:
+            self._string_containers.pop()
+        if element is self._capture:
+            self._capture = None
+            self._emit(element)
+        return element
+
+
+    def _emit(self, element: _Element) -> None:
+        """
+        Append the Markdown of a closed text or image element, and stop parsing once the output is long enough.
+        """
+        if self._capture_is_image:
             # check if image url is valid
-            if element.attrs.get("src", "").startswith("http"):
-                html_content.append(str(element))
-            element.decompose()
-        elif element.name in text_tags:
-            if element.name == "li":
-                html_content.append("- " + element.get_text())
-            elif element.name == "h1":
-                html_content.append("# " + element.get_text())
-            elif element.name == "h2":
-                html_content.append("## " + element.get_text())
-            elif element.name == "h3":
-                html_content.append("### " + element.get_text())
-            elif element.name == "h4":
-                html_content.append("#### " + element.get_text())
-            else:
-                html_content.append(element.get_text())
-            element.decompose()
-    return "\n".join(html_content).strip(" \n")
-
-
-def _recursively_remove_attrs(tag: _OneElement, attrs: list[str]) -> _OneElement:
-    """
-    Removes all attributes other than the specified ones from the element and its children, 
-    and returns the modified tag
-
-    :param _OneElement tag: The element to be stripped
-    :param list[str] attrs: The list of attributes to keep
-    """
-    tag.attrs = {key: value for key, value in tag.attrs.items() if key in attrs}
-    for element in tag.find_all():
-        element.attrs = {key: value for key, value in element.attrs.items() if key in attrs}
-    return tag
\ No newline at end of file
+            if not element.attrs.get("src", "").startswith("http"):
+                return
+            part = _render_html(element)
+        else:
+            part = TEXT_PREFIXES.get(element.name, "") + "".join(self._strings)
+        self.parts.append(part)
+        self._length += len(part) + 1
+        if self.max_length is not None and self._length > self.max_length:
+            # the output is final once it has a non-whitespace character past the budget
+            if len("\n".join(self.parts).strip(" \n")) > self.max_length:
+                raise _BudgetReached()
+
+
+def _render_html(element: _Element) -> str:
+    """
+    Render an image element back into html, keeping only its `src` attributes.
+    """
+    src = element.attrs.get("src")
+    attrs = "" if src is None else " src=" + EntitySubstitution.quoted_attribute_value(EntitySubstitution.substitute_xml(src))
+    if not element.contents and element.name in VOID_ELEMENTS:
+        return f"<{element.name}{attrs}/>"
+    html = [f"<{element.name}{attrs}>"]
+    for child in element.contents:
+        if isinstance(child, _Element):
+            html.append(_render_html(child))
+            continue
+        kind, data = child
+        if kind in SPECIAL_STRING_FORMATS:
+            html.append(SPECIAL_STRING_FORMATS[kind].format(data))
+        elif element.name in ("script", "style"):
+            html.append(data)
+        else:
+            html.append(EntitySubstitution.substitute_xml(data))
+    html.append(f"</{element.name}>")
+    return "".join(html)
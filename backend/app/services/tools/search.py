@@ -1,15 +1,28 @@
+import json
+import random
 import time
+from functools import lru_cache
 
 from loguru import logger
 from langchain_community.tools import DuckDuckGoSearchResults
 from langchain_community.utilities import DuckDuckGoSearchAPIWrapper
 
+from app.core.config import settings
+from app.core.concurrency import search_limiter
+from app.core.singleflight import SingleFlight
+from app.dependencies.cache import create_cache
 from app.types.search import SearchResults
 
 wrapper = DuckDuckGoSearchAPIWrapper(region="sg-en", time="y")
 
 RETRIES = 3
-BACKOFF = 2
+BACKOFF = 1
+MAX_BACKOFF = 4
+
+search_cache = create_cache(
+    "search_cache", settings.SEARCH_CACHE_BACKEND, settings.SEARCH_CACHE_TTL, settings.SEARCH_CACHE_MAX_SIZE
+)
+search_flight = SingleFlight("search")
 
 def search_duckduckgo(query: str, max_results: int = 3) -> list[str]:
     """
@@ -18,14 +31,56 @@ def search_duckduckgo(query: str, max_results: int = 3) -> list[str]:
     :param str query: The search query.
     :return: The list of relevant URLs.
     """
-    search = DuckDuckGoSearchResults(api_wrapper=wrapper, output_format="list", max_results=max_results)
+    return [result.link for result in search_results(query, max_results)]
+
+
+def search_results(query: str, max_results: int = 3) -> list[SearchResults]:
+    """
+    Perform a web search of the query and return the full search results. Results are cached, and identical
+    searches that run concurrently share a single request to DuckDuckGo.
+
+    :param str query: The search query.
+    :param int max_results: The maximum number of results to return.
+    :return list[SearchResults]: The snippet, title and link of each result.
+    """
+    key = _cache_key(query, max_results)
+    cached = search_cache.get(key)
+    if cached is not None:
+        return [SearchResults.model_validate(r) for r in json.loads(cached)]
+    return search_flight.do(key, _search_and_cache, key, query, max_results)
+
+
+def _search_and_cache(key: str, query: str, max_results: int) -> list[SearchResults]:
+    """
+    Query DuckDuckGo, retrying with exponential backoff, and cache successful results.
+    """
+    search = _get_search_tool(max_results)
     for i in range(RETRIES + 1):
         try:
-            raw_results = search.invoke(query)
+            with search_limiter:
+                raw_results = search.invoke(query)
             results = [SearchResults.model_validate(r) for r in raw_results]
-            return [result.link for result in results]
+            search_cache.set(key, json.dumps([r.model_dump() for r in results]))
+            return results
         except Exception as e:
             logger.error(f"Failed to retrieve search results: {e}")
-            time.sleep((i + 1) * BACKOFF)
-    
-    return []
\ No newline at end of file
+            if i < RETRIES:
+                time.sleep(min(BACKOFF * 2 ** i, MAX_BACKOFF) * random.uniform(0.5, 1))
+
+    return []
+
+
+@lru_cache
+def _get_search_tool(max_results: int) -> DuckDuckGoSearchResults:
+    """
+    Return the search tool for the given number of results. Tools are created once and reused.
+    """
+    return DuckDuckGoSearchResults(api_wrapper=wrapper, output_format="list", max_results=max_results)
+
+
+def _cache_key(query: str, max_results: int) -> str:
+    """
+    Build the cache key of a search. Queries that only differ in case or whitespace share the same key.
+    """
+    normalized_query = " ".join(query.casefold().split())
+    return json.dumps([normalized_query, max_results, wrapper.region, wrapper.time])
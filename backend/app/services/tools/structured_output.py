@@ -3,17 +3,20 @@ import json
 from loguru import logger
 from langchain_core.messages import SystemMessage, HumanMessage
 
+from app.core.config import settings
 from app.dependencies.llm import llm
 from app.types.model_outputs import PreliminaryLocationData
 from app.types.model_json_schema import PRELIMINARY_LOCATION_JSON_SCHEMA
 from app.services.prompts import (
     PRELIMINARY_INFORMATION_PROMPT, 
+    BATCH_INFORMATION_PROMPT, 
     CANDIDATE_LOCATIONS_PROMPT, 
     SEARCH_QUERY_PROMPT, 
     STRUCTURED_OUTPUT_SYSTEM_PROMPT, 
-    STRUCTURED_RESPONSE_SYSTEM_PROMPT, 
-    COMPARE_INFORMATION_PROMPT)
-from app.services.parser import parse_preliminary_location, parse_string_list
+    RESOLVE_CONFLICTS_PROMPT)
+from app.core.json_stream import is_complete_json
+from app.services.candidates import CandidateIndex
+from app.services.parser import parse_choice_list, parse_preliminary_location, parse_preliminary_location_list, parse_string_list
 
 
 def get_preliminary_location(text: str, location_name: str) -> PreliminaryLocationData | None:
@@ -36,6 +39,48 @@ def get_preliminary_location(text: str, location_name: str) -> PreliminaryLocati
     return parse_preliminary_location(content)
 
 
+def get_preliminary_locations(text: str, location_names: list[str]) -> list[PreliminaryLocationData | None]:
+    """
+    Extract information of several locations from the same input text, with one LLM call for every 
+    `BATCH_EXTRACTION_SIZE` locations.
+
+    :param str text: The raw text to extract information from
+    :param list[str] location_names: The names of the locations of interest
+    :return list[PreliminaryLocationData | None]: The information of each location, in the order of 
+    `location_names`. If no information is found for a location, its entry is None.
+    """
+    system_prompt = STRUCTURED_OUTPUT_SYSTEM_PROMPT.format(
+        json_schema=f"[\n{PRELIMINARY_LOCATION_JSON_SCHEMA}\n]"
+    )
+    results: list[PreliminaryLocationData | None] = []
+    for i in range(0, len(location_names), settings.BATCH_EXTRACTION_SIZE):
+        names = location_names[i:i + settings.BATCH_EXTRACTION_SIZE]
+        prompt = BATCH_INFORMATION_PROMPT.format(
+            text=text.strip(" \n"),
+            names="\n".join(f"- {name}" for name in names)
+        )
+        logger.trace(prompt)
+        content = llm.invoke(HumanMessage(prompt), SystemMessage(system_prompt))
+        locations = parse_preliminary_location_list(content)
+        if locations and not is_complete_json(content):
+            # the last location was cut off, so it is left out rather than seeded with partial details
+            logger.warning(f"Batch extraction of {names} was cut off after {len(locations)} location(s)")
+            locations.pop()
+        # locations are only matched by name, so that the details of a location are never given to another 
+        # one when the model drops, renames or reorders them. Unmatched locations are searched for normally.
+        index = CandidateIndex()
+        for name in names:
+            index.add(name)
+        by_name: dict[str, PreliminaryLocationData] = {}
+        for location in locations:
+            name = index.add(location.name)
+            if name in names and name not in by_name:
+                location.name = name
+                by_name[name] = location
+        results.extend(by_name.get(name) for name in names)
+    return results
+
+
 def get_candidate_locations(text: str, query: str) -> list[str]:
     """
     Extract locations that are relevant to the query from the input text.
@@ -55,18 +100,20 @@ def get_candidate_locations(text: str, query: str) -> list[str]:
     return refined_locations
     
 
-def get_search_queries(location_name: str, location: PreliminaryLocationData) -> list[str]:
+def get_search_queries(location_name: str, location: PreliminaryLocationData, missing: list[str]) -> list[str]:
     """
     Generate a list of logical search queries to fill the missing information in 
     the current location object.
 
     :param str location_name: The name of the location
     :param PreliminaryLocationData location: The current information of the location
+    :param list[str] missing: The names of the fields that are still missing, which the queries should target
     :return list[str]: The list of search queries
     """
     prompt = SEARCH_QUERY_PROMPT.format(
         query=location_name,
         information=json.dumps(location.model_dump(mode="json")),
+        missing=", ".join(missing),
     )
     logger.trace(prompt)
     content = llm.invoke(HumanMessage(prompt))
@@ -75,21 +122,22 @@ def get_search_queries(location_name: str, location: PreliminaryLocationData) ->
     return refined_queries
 
 
-def update_location_data(old_data: PreliminaryLocationData, new_data: PreliminaryLocationData | None) -> PreliminaryLocationData:
+def resolve_conflicts(location_name: str, conflicts: list[tuple[str, str, str]]) -> list[int]:
     """
-    Update the old location data with field(s) from the new location data. 
+    Let the LLM decide which of two different values of a field is correct, for each conflicting field.
 
-    :param PreliminaryLocationData old_data: The old location data
-    :param PreliminaryLocationData new_data: The newly generated location data
-    :return PreliminaryLocationData: The combined location data
+    :param str location_name: The name of the location
+    :param list[tuple[str, str, str]] conflicts: The path of the field, the current value and the new value 
+    of each conflict
+    :return list[int]: For each conflict, 1 to keep the current value or 2 to use the new value
     """
-    prompt = COMPARE_INFORMATION_PROMPT.format(
-        document_1=old_data.model_dump_json(),
-        document_2=new_data.model_dump_json()
-    )
-    system_prompt = STRUCTURED_RESPONSE_SYSTEM_PROMPT.format(
-        json_schema=PRELIMINARY_LOCATION_JSON_SCHEMA
+    prompt = RESOLVE_CONFLICTS_PROMPT.format(
+        name=location_name,
+        conflicts="\n".join(
+            f"{i}. {field}\n   1: {json.dumps(old)}\n   2: {json.dumps(new)}" 
+            for i, (field, old, new) in enumerate(conflicts, start=1)
+        ),
     )
     logger.trace(prompt)
-    content = llm.invoke(HumanMessage(prompt), SystemMessage(system_prompt))
-    return parse_preliminary_location(content)
\ No newline at end of file
+    content = llm.invoke(HumanMessage(prompt))
+    return parse_choice_list(content, len(conflicts))
@@ -1,6 +1,18 @@
 from app.types.model_outputs import PreliminaryLocationData, PreliminaryOpeningHours, TimeInterval, PreliminaryImageData, Offering
 from app.types.schema import LocationData, ImageData, OpeningHours
 
+DAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+# every group of fields weighs the same in the completeness score, and each day is a seventh of the opening hours
+COMPLETENESS_WEIGHTS = {
+    "address": 1.0,
+    "contact": 1.0,
+    **{f"opening hours on {day}": 1 / len(DAYS) for day in DAYS},
+    "description": 1.0,
+    "offerings": 1.0,
+    "images": 1.0,
+}
+
+
 def initialise_preliminary_locations(locations: list[str]) -> list[PreliminaryLocationData]:
     """
     Generate empty `PreliminaryLocationData` objects based on the list of location names.
@@ -48,6 +60,44 @@ def initialise_preliminary_locations(locations: list[str]) -> list[PreliminaryLo
     ) for location in locations]
 
 
+def missing_fields(location: PreliminaryLocationData) -> list[str]:
+    """
+    List the fields of a `PreliminaryLocationData` object that are still empty. An opening hours interval 
+    is missing if either its start or end is empty.
+
+    :param PreliminaryLocationData location: The location data
+    :return list[str]: The names of the missing fields, as keys of `COMPLETENESS_WEIGHTS`
+    """
+    missing = []
+    if not location.address.strip():
+        missing.append("address")
+    if not location.contact.strip():
+        missing.append("contact")
+    for day in DAYS:
+        interval: TimeInterval = getattr(location.opening_hours, day)
+        if not interval.start.strip() or not interval.end.strip():
+            missing.append(f"opening hours on {day}")
+    if not location.description.strip():
+        missing.append("description")
+    if not location.offerings:
+        missing.append("offerings")
+    if not location.images:
+        missing.append("images")
+    return missing
+
+
+def location_completeness(location: PreliminaryLocationData) -> float:
+    """
+    Score how complete a `PreliminaryLocationData` object is, from 0 (only the name is known) to 1 (every 
+    field is filled).
+
+    :param PreliminaryLocationData location: The location data
+    :return float: The weighted fraction of filled fields
+    """
+    total = sum(COMPLETENESS_WEIGHTS.values())
+    return (total - sum(COMPLETENESS_WEIGHTS[field] for field in missing_fields(location))) / total
+
+
 def preliminary_to_final_location_data(preliminary: PreliminaryLocationData, citations: list[str]) -> LocationData:
     """
     Convert a `PreliminaryLocationData` object to a `LocationData` object. Missing fields are left as either blank 
@@ -101,4 +151,32 @@ def preliminary_to_final_location_data(preliminary: PreliminaryLocationData, cit
             contact=preliminary.contact,
             images=format_images(preliminary.images),
             citation=citations
-        )
\ No newline at end of file
+        )
+
+
+def final_to_preliminary_location_data(location: LocationData) -> PreliminaryLocationData:
+    """
+    Convert a `LocationData` object back to a `PreliminaryLocationData` object, e.g. to continue enriching a 
+    stored location. The captions and hashtags of the images and the citations are dropped.
+
+    :param LocationData location: The `LocationData` object
+    :return PreliminaryLocationData: The transformed object
+    """
+    def parse_time(time: str) -> str:
+        return f"{time[:2]}:{time[2:]}" if len(time) == 4 and time.isdigit() else time
+
+    def parse_opening_hours(hours: str) -> TimeInterval:
+        start, _, end = hours.partition("-")
+        return TimeInterval(start=parse_time(start), end=parse_time(end))
+
+    return PreliminaryLocationData(
+        name=location.name,
+        address=location.address,
+        opening_hours=PreliminaryOpeningHours(**{
+            day: parse_opening_hours(getattr(location.opening_hours, day)) for day in DAYS
+        }),
+        description=location.description,
+        offerings=[Offering(name=name, price=price) for name, price in location.offerings.items()],
+        contact=location.contact,
+        images=[PreliminaryImageData(name=name, url=image.url) for name, image in location.images.items()],
+    )
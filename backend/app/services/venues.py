@@ -0,0 +1,139 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from loguru import logger
+
+from app.core.config import settings
+from app.services.candidates import name_key
+from app.types.schema import LocationData
+from app.types.venue import StoredVenue
+
+VENUE_FIELDS = ["address", "contact", "opening_hours", "description", "offerings", "images"]
+
+
+class VenueStore:
+    """
+    Persists enriched venues in a local SQLite database, keyed by their normalized name, so that venues that
+    were enriched by earlier requests can be served again. The time at which each field was last enriched
+    is kept, and a field goes stale after its own time-to-live in `VENUE_STORE_TTLS`. Fields that could not
+    be found are always stale.
+    """
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS venues (key TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at TEXT NOT NULL)"
+        )
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> StoredVenue | None:
+        """
+        Retrieve a stored venue by name.
+
+        :param str name: The name of the venue, which is normalized into the key of the venue
+        :return StoredVenue | None: The stored venue, or None if it has never been stored
+        """
+        return self.get_by_key(name_key(name))
+
+    def get_by_key(self, key: str) -> StoredVenue | None:
+        """
+        Retrieve a stored venue by its key, i.e. its normalized name.
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT data, updated_at FROM venues WHERE key = ?", (key,)).fetchone()
+        return self._to_stored_venue(key, *row) if row else None
+
+    def entries(self) -> list[StoredVenue]:
+        """
+        Return every stored venue, ordered by key.
+        """
+        with self._lock:
+            rows = self._connection.execute("SELECT key, data, updated_at FROM venues ORDER BY key").fetchall()
+        return [self._to_stored_venue(*row) for row in rows]
+
+    def save(self, name: str, venue: LocationData, fields: list[str] = VENUE_FIELDS) -> None:
+        """
+        Store a venue, replacing the stored version. Fields that were not enriched again keep the time at
+        which they were last enriched.
+
+        :param str name: The name the venue is looked up by, which is normalized into the key of the venue
+        :param LocationData venue: The venue, including the captions of its images
+        :param list[str] fields: The fields that were enriched
+        """
+        key = name_key(name)
+        if not key:
+            return
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute("SELECT updated_at FROM venues WHERE key = ?", (key,)).fetchone()
+            updated_at = json.loads(row[0]) if row else {}
+            updated_at.update({field: now for field in fields})
+            self._connection.execute(
+                "INSERT OR REPLACE INTO venues (key, data, updated_at) VALUES (?, ?, ?)",
+                (key, venue.model_dump_json(), json.dumps(updated_at))
+            )
+
+    def invalidate(self, key: str, fields: list[str] | None = None) -> bool:
+        """
+        Mark some fields of a stored venue as stale, so that they are enriched again by the next request
+        for the venue, or remove the venue entirely.
+
+        :param str key: The key of the venue
+        :param list[str] | None fields: The fields to mark as stale. If None, the venue is removed.
+        :return bool: Whether the venue was stored
+        """
+        with self._lock:
+            if fields is None:
+                return self._connection.execute("DELETE FROM venues WHERE key = ?", (key,)).rowcount > 0
+            row = self._connection.execute("SELECT updated_at FROM venues WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return False
+            updated_at = {field: t for field, t in json.loads(row[0]).items() if field not in fields}
+            self._connection.execute("UPDATE venues SET updated_at = ? WHERE key = ?", (json.dumps(updated_at), key))
+            return True
+
+    def clear(self) -> int:
+        """
+        Remove every stored venue, returning the number of venues removed.
+        """
+        with self._lock:
+            return self._connection.execute("DELETE FROM venues").rowcount
+
+    def _to_stored_venue(self, key: str, data: str, updated_at: str) -> StoredVenue:
+        venue = LocationData.model_validate_json(data)
+        updated_at = json.loads(updated_at)
+        now = time.time()
+        stale_fields = []
+        for field in VENUE_FIELDS:
+            # missing fields are always enriched again, so that only complete venues are served whole
+            if not _has_value(venue, field) or updated_at.get(field, 0) + settings.VENUE_STORE_TTLS.get(field, 0) <= now:
+                stale_fields.append(field)
+        return StoredVenue(key=key, venue=venue, updated_at=updated_at, stale_fields=stale_fields)
+
+
+def _has_value(venue: LocationData, field: str) -> bool:
+    """
+    Whether a field of a venue was found. The opening hours are found if the hours of any day are known, 
+    since days on which the venue is closed are left empty.
+    """
+    if field == "opening_hours":
+        return any(hours.strip("-") for hours in venue.opening_hours.model_dump().values())
+    value = getattr(venue, field)
+    return bool(value.strip() if isinstance(value, str) else value)
+
+
+def _create_venue_store() -> VenueStore:
+    path = os.path.join(settings.DATA_DIR, "venues.sqlite3")
+    try:
+        return VenueStore(path)
+    except sqlite3.Error as e:
+        logger.error(f"Failed to open {path}, falling back to an in-memory venue store: {e}")
+        return VenueStore(":memory:")
+
+
+venue_store = _create_venue_store()
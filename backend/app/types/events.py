@@ -0,0 +1,63 @@
+from typing import Annotated, Literal, Union
+
+from pydantic import BaseModel, Field
+
+from app.types.schema import LocationData
+
+class VenueEvent(BaseModel):
+    """
+    Emitted as soon as a location has been enriched. The captions and hashtags of its images are still empty.
+
+    :param int index: The rank of the location among the candidate locations
+    :param LocationData venue: The location information
+    :param float completeness: The weighted fraction of the fields of the location that were filled, from 0 to 1
+    :param int iterations: The number of search iterations run for the location
+    """
+    event: Literal["venue"] = "venue"
+    index: int
+    venue: LocationData
+    completeness: float
+    iterations: int
+
+
+class CaptionEvent(BaseModel):
+    """
+    Emitted when the caption and hashtags of an image of a previously emitted location are ready.
+
+    :param int index: The rank of the location the image belongs to
+    :param str image: The name of the image in `LocationData.images`
+    :param str caption: The caption of the image
+    :param list[str] hashtags: The hashtags of the image
+    """
+    event: Literal["caption"] = "caption"
+    index: int
+    image: str
+    caption: str
+    hashtags: list[str]
+
+
+class DoneEvent(BaseModel):
+    """
+    Emitted once every location and caption has been emitted.
+
+    :param int count: The number of locations emitted
+    :param int iterations: The number of search iterations run over all locations
+    :param int iterations_saved: The number of search iterations skipped because locations were complete early
+    """
+    event: Literal["done"] = "done"
+    count: int
+    iterations: int
+    iterations_saved: int
+
+
+class ErrorEvent(BaseModel):
+    """
+    Emitted if the request failed after the response started streaming.
+
+    :param str detail: The reason of the failure
+    """
+    event: Literal["error"] = "error"
+    detail: str
+
+
+LocationEvent = Annotated[Union[VenueEvent, CaptionEvent, DoneEvent, ErrorEvent], Field(discriminator="event")]
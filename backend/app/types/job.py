@@ -0,0 +1,30 @@
+from typing import Literal
+
+from pydantic import BaseModel
+
+from app.types.payload import SearchPayload
+from app.types.schema import LocationData
+
+JobStatus = Literal["queued", "running", "succeeded", "failed"]
+
+class Job(BaseModel):
+    """
+    A search request that is processed in the background.
+
+    :param str id: The id of the job
+    :param JobStatus status: Either `queued`, `running`, `succeeded` or `failed`
+    :param SearchPayload request: The search request
+    :param list[LocationData] results: The locations enriched so far, ordered by rank. Image captions are filled in as they are generated.
+    :param str | None error: The reason of the failure, if the job failed
+    :param int version: Incremented every time the job is updated
+    :param float created_at: The UNIX timestamp at which the job was submitted
+    :param float updated_at: The UNIX timestamp at which the job was last updated
+    """
+    id: str
+    status: JobStatus
+    request: SearchPayload
+    results: list[LocationData]
+    error: str | None = None
+    version: int
+    created_at: float
+    updated_at: float
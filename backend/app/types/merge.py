@@ -0,0 +1,37 @@
+from typing import Literal
+
+from pydantic import BaseModel
+
+from app.types.model_outputs import PreliminaryLocationData
+
+class FieldChange(BaseModel):
+    """
+    A change made to a single field when merging newly extracted location data into the current data.
+
+    :param str field: The path of the field, e.g. `address`, `opening_hours.monday` or `offerings[Latte]`
+    :param str old: The previous value of the field, or an empty string if the field was empty
+    :param str new: The new value of the field
+    :param str action: `filled` if the field was empty, `added` for a new offering or image, and `replaced` 
+    if the previous value was overwritten
+    :param str source: `rule` if the change was decided deterministically, `llm` if the LLM settled a conflict
+    """
+    field: str
+    old: str
+    new: str
+    action: Literal["filled", "added", "replaced"]
+    source: Literal["rule", "llm"] = "rule"
+
+
+class MergeResult(BaseModel):
+    """
+    The outcome of merging newly extracted location data into the current data.
+
+    :param PreliminaryLocationData location: The merged location data
+    :param list[FieldChange] changes: The fields that changed, empty if the new data added nothing
+    :param int conflicts: The number of fields where both sides had different values
+    :param bool used_llm: Whether the LLM was called to settle the conflicts
+    """
+    location: PreliminaryLocationData
+    changes: list[FieldChange]
+    conflicts: int
+    used_llm: bool
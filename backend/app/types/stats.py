@@ -0,0 +1,132 @@
+from pydantic import BaseModel
+
+class BrowserPoolStats(BaseModel):
+    """
+    Runtime statistics of the shared browser pool.
+
+    :param bool started: Whether the browser has been launched
+    :param int size: The number of browser contexts in the pool
+    :param int max_uses: The number of page loads after which a context is recycled
+    :param int in_use: The number of contexts currently rendering a page
+    :param int idle: The number of contexts waiting to be borrowed
+    :param int total_fetches: The number of pages requested since startup
+    :param int failed_fetches: The number of pages that returned no content
+    :param int contexts_recycled: The number of contexts closed and replaced
+    :param int browser_restarts: The number of times the browser had to be relaunched
+    :param int blocked_requests: The number of requests for heavy resources or ad/analytics hosts that were aborted
+    :param int ready_timeouts: The number of pages whose text was still changing when their timeout ran out
+    :param int learned_domains: The number of domains with a learned rendering timeout
+    """
+    started: bool
+    size: int
+    max_uses: int
+    in_use: int
+    idle: int
+    total_fetches: int
+    failed_fetches: int
+    contexts_recycled: int
+    browser_restarts: int
+    blocked_requests: int
+    ready_timeouts: int
+    learned_domains: int
+
+
+class ScraperStats(BaseModel):
+    """
+    Runtime statistics of how pages are fetched by the scraper.
+
+    :param bool http_first: Whether pages are downloaded without a browser first
+    :param int http_fetches: The number of pages scraped without a browser since startup
+    :param int browser_fetches: The number of pages rendered with the browser since startup
+    :param int browser_fallbacks: The number of pages downloaded without a browser that had to be rendered since startup
+    """
+    http_first: bool
+    http_fetches: int
+    browser_fetches: int
+    browser_fallbacks: int
+
+
+class CacheStats(BaseModel):
+    """
+    Runtime statistics of a cache.
+
+    :param str name: The name of the cache
+    :param int entries: The number of entries currently stored
+    :param int size: The total size of the stored values in bytes
+    :param int max_size: The size in bytes above which the least recently used entries are evicted
+    :param float ttl: The default time-to-live of each entry in seconds
+    :param int hits: The number of lookups that found a fresh entry since startup
+    :param int misses: The number of lookups that found no entry or an expired entry since startup
+    :param float hit_rate: The fraction of lookups that were hits
+    :param int evictions: The number of entries evicted for being expired or least recently used since startup
+    """
+    name: str
+    entries: int
+    size: int
+    max_size: int
+    ttl: float
+    hits: int
+    misses: int
+    hit_rate: float
+    evictions: int
+
+
+class GuardrailStats(BaseModel):
+    """
+    Runtime statistics of the Bedrock guardrail.
+
+    :param bool enabled: Whether guardrails are applied
+    :param bool optimistic: Whether input checks run at the same time as generation
+    :param int calls: The number of calls made to the guardrail since startup
+    :param int cache_hits: The number of checks answered by the verdict cache since startup
+    :param int interventions: The number of checks where the guardrail intervened since startup
+    :param float mean_latency: The mean latency of a guardrail call in seconds
+    """
+    enabled: bool
+    optimistic: bool
+    calls: int
+    cache_hits: int
+    interventions: int
+    mean_latency: float
+
+
+class LLMStats(BaseModel):
+    """
+    Runtime statistics of the text LLM.
+
+    :param bool guardrail_enabled: Whether guardrails are applied
+    :param bool guardrail_optimistic: Whether input checks run at the same time as generation
+    :param int invocations: The number of completions requested since startup
+    :param int cache_hits: The number of completions served from the completion cache since startup
+    :param int generations: The number of completions generated by Bedrock since startup
+    :param int early_stops: The number of streamed completions that were stopped as soon as their JSON value was complete
+    :param int regenerations: The number of streamed completions that hit the stop sequence before any JSON value, and were generated again without it
+    :param float mean_invocation_latency: The mean latency of a completion in seconds, including guardrail checks
+    :param float mean_generation_latency: The mean latency of a Bedrock generation in seconds, including retries
+    """
+    guardrail_enabled: bool
+    guardrail_optimistic: bool
+    invocations: int
+    cache_hits: int
+    generations: int
+    early_stops: int
+    regenerations: int
+    mean_invocation_latency: float
+    mean_generation_latency: float
+
+
+class SingleFlightStats(BaseModel):
+    """
+    Runtime statistics of a single-flight group, which lets concurrent identical calls share one execution.
+
+    :param str name: The name of the group
+    :param int in_flight: The number of calls currently running
+    :param int executions: The number of calls that were run since startup
+    :param int coalesced: The number of calls that shared the result of a running call since startup
+    :param float coalesced_rate: The fraction of calls that were coalesced
+    """
+    name: str
+    in_flight: int
+    executions: int
+    coalesced: int
+    coalesced_rate: float
@@ -0,0 +1,19 @@
+from pydantic import BaseModel
+
+from app.types.schema import LocationData
+
+
+class StoredVenue(BaseModel):
+    """
+    A previously enriched venue in the venue store.
+
+    :param str key: The normalized name of the venue
+    :param LocationData venue: The venue, including the captions of its images and its citations
+    :param dict[str, float] updated_at: The UNIX timestamp at which each field was last enriched
+    :param list[str] stale_fields: The fields that are missing or older than their time-to-live, and have to 
+    be enriched again
+    """
+    key: str
+    venue: LocationData
+    updated_at: dict[str, float]
+    stale_fields: list[str]
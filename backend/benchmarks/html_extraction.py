@@ -0,0 +1,92 @@
+"""
+Benchmark of the html to Markdown step of the scraper. Compares the single-pass extractor against the
+previous implementation, which built a full BeautifulSoup tree of the page, and checks that both produce
+the same output on every page of the corpus.
+
+The corpus is a directory of pages saved as `.html` files (e.g. with "Save Page As..." in a browser, or
+from `page.content()` in Playwright). A few pages are kept in `benchmarks/pages`.
+
+Run from the `backend` directory (the usual `BEDROCK_*` environment variables must be set):
+    python -m benchmarks.html_extraction [--pages benchmarks/pages] [--iterations 20]
+"""
+import argparse
+import time
+from pathlib import Path
+from typing import Callable
+
+import bs4
+
+from app.services.tools.scraper import MAX_MARKDOWN_LENGTH, _parse_html
+
+
+def _legacy_parse_html(content: str, text_tags: list[str] = ["p", "h1", "h2", "h3", "h4", "li"], image_tags: list[str] = ["img"]) -> str:
+    """
+    The previous implementation: build the tree, then extract and decompose every matching element.
+    """
+    soup = bs4.BeautifulSoup(content, "html.parser")
+    html_content = []
+    for element in soup.find_all():
+        if element.name in image_tags:
+            element.attrs = {key: value for key, value in element.attrs.items() if key == "src"}
+            for child in element.find_all():
+                child.attrs = {key: value for key, value in child.attrs.items() if key == "src"}
+            if element.attrs.get("src", "").startswith("http"):
+                html_content.append(str(element))
+            element.decompose()
+        elif element.name in text_tags:
+            prefix = {"li": "- ", "h1": "# ", "h2": "## ", "h3": "### ", "h4": "#### "}.get(element.name, "")
+            html_content.append(prefix + element.get_text())
+            element.decompose()
+    return "\n".join(html_content).strip(" \n")
+
+
+def _time(function: Callable[[str], str], content: str, iterations: int) -> float:
+    """
+    Return the mean time taken per call in milliseconds.
+    """
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function(content)
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=Path, default=Path(__file__).parent / "pages")
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    pages = sorted(args.pages.glob("*.html"))
+    if not pages:
+        parser.error(f"no .html pages found in {args.pages}")
+
+    extractors = {
+        "legacy": lambda c: _legacy_parse_html(c)[:MAX_MARKDOWN_LENGTH],
+        "full": _parse_html,
+        "budget": lambda c: _parse_html(c, max_length=MAX_MARKDOWN_LENGTH),
+    }
+    print(f"{'page':<32}{'size (kB)':>12}{'legacy (ms)':>14}{'full (ms)':>12}{'budget (ms)':>14}{'identical':>12}")
+    mismatches = 0
+    totals = dict.fromkeys(extractors, 0.0)
+    for page in pages:
+        content = page.read_text(encoding="utf-8", errors="replace")
+        expected = _legacy_parse_html(content)
+        identical = (
+            _parse_html(content) == expected
+            and _parse_html(content, max_length=MAX_MARKDOWN_LENGTH) == expected[:MAX_MARKDOWN_LENGTH]
+        )
+        mismatches += not identical
+        timings = {name: _time(function, content, args.iterations) for name, function in extractors.items()}
+        for name, timing in timings.items():
+            totals[name] += timing
+        print(
+            f"{page.name[:31]:<32}{len(content) / 1024:>12.1f}{timings['legacy']:>14.2f}"
+            f"{timings['full']:>12.2f}{timings['budget']:>14.2f}{str(identical):>12}"
+        )
+    print(f"{'total':<32}{'':>12}{totals['legacy']:>14.2f}{totals['full']:>12.2f}{totals['budget']:>14.2f}{mismatches == 0!s:>12}")
+    if mismatches:
+        raise SystemExit(f"{mismatches} page(s) produced different output")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Benchmark and regression check of the JSON extraction step of the LLM output parsers. Compares the
+single-pass scanner against the previous implementation, which searched the output with a series of
+greedy regular expressions, and checks the parsed output of every entry of the corpus.
+
+The corpus is a JSON Lines file with one LLM output per line, together with the parser it is meant for
+and the expected result of that parser. Outputs of the shapes produced by the text models for the
+prompts in `services/prompts.py` (closing fences, commentary after the value, trailing commas, outputs cut
+off at `max_tokens`...) are kept in `benchmarks/llm_outputs.jsonl`; add new ones whenever a parsing
+failure shows up in the logs.
+
+Run from the `backend` directory (the usual `BEDROCK_*` environment variables must be set):
+    python -m benchmarks.json_parsing [--corpus benchmarks/llm_outputs.jsonl] [--iterations 200] [--sizes 1000 4000 16000]
+"""
+import argparse
+import json
+import re
+import time
+from pathlib import Path
+from typing import Any, Callable
+from unittest import mock
+
+from app.services import parser
+
+PARSERS: dict[str, Callable[[dict[str, Any]], Any]] = {
+    "string_list": lambda case: parser.parse_string_list(case["output"]),
+    "choice_list": lambda case: parser.parse_choice_list(case["output"], case["n_choices"]),
+    "preliminary_location": lambda case: (
+        location.model_dump() if (location := parser.parse_preliminary_location(case["output"])) else None
+    ),
+    "preliminary_location_list": lambda case: [
+        location.model_dump() for location in parser.parse_preliminary_location_list(case["output"])
+    ],
+    "image_details": lambda case: list(parser.parse_image_details(case["output"])),
+}
+OPENINGS = {"string_list": "[", "choice_list": "[", "preliminary_location_list": "[", "preliminary_location": "{", "image_details": "{"}
+
+
+def _legacy_scan_json(string: str, openings: str = "{[") -> Any | None:
+    """
+    The previous implementation: look for a fenced value, then fall back to the outermost list or object.
+    """
+    value = _legacy_parse_json_in_backticks(string)
+    expected = list if openings == "[" else dict
+    if not value or type(value) != expected:
+        value = _legacy_parse_json_list(string) if openings == "[" else _legacy_parse_json_dict(string)
+    return value
+
+
+def _legacy_parse_json_in_backticks(string: str) -> Any | None:
+    match = re.search(r"\`\`\`json(.+?)\`\`\`", string, re.DOTALL)
+    if not match:
+        match = re.search(r"(.+)\`\`\`", string, re.DOTALL)
+    if not match:
+        return None
+    try:
+        raw_json = match.group(1).strip(" \n")
+        return json.loads(raw_json)
+    except:
+        try:
+            removed_last_comma = "".join(list(reversed(list(reversed(raw_json)).remove(","))))
+            return json.loads(removed_last_comma)
+        except:
+            return None
+
+
+def _legacy_parse_json_list(string: str) -> list[Any] | None:
+    match = re.search(r"(\[.+\])", string, re.DOTALL)
+    if not match:
+        return None
+    try:
+        return json.loads(match.group(1).strip(" \n"))
+    except:
+        return None
+
+
+def _legacy_parse_json_dict(string: str) -> dict[str, Any] | None:
+    match = re.search(r"(\{.+\})", string, re.DOTALL)
+    if not match:
+        return None
+    try:
+        return json.loads(match.group(1).strip(" \n"))
+    except:
+        return None
+
+
+def _synthetic_outputs(size: int) -> dict[str, tuple[str, str]]:
+    """
+    Generate long outputs of about `size` characters: a long list that is closed properly, and outputs
+    that are cut off or followed by commentary with stray brackets.
+    """
+    items = [f'"Search query number {i} for the location"' for i in range(size // 40)]
+    listing = "[\n" + ",\n".join(items) + "\n]"
+    prose = " ".join(f"word{i} (see [{i}])" for i in range(size // 16))
+    return {
+        "long list": (listing + "\n```", "["),
+        "long list cut off": (listing[:-10], "["),
+        "commentary": ('{"caption": "A caption", "hashtags": []}\n```\n' + prose, "{"),
+        "no closing fence": ("{" + prose, "{"),
+    }
+
+
+def _time(function: Callable[[], Any], iterations: int) -> float:
+    """
+    Return the mean time taken per call in milliseconds.
+    """
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argument_parser.add_argument("--corpus", type=Path, default=Path(__file__).parent / "llm_outputs.jsonl")
+    argument_parser.add_argument("--iterations", type=int, default=200)
+    argument_parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 4000, 16000])
+    args = argument_parser.parse_args()
+
+    cases = [json.loads(line) for line in args.corpus.read_text(encoding="utf-8").splitlines() if line.strip()]
+    if not cases:
+        argument_parser.error(f"no outputs found in {args.corpus}")
+
+    print(f"{'output':<44}{'legacy (ms)':>14}{'scanner (ms)':>14}{'legacy ok':>12}{'scanner ok':>12}")
+    failures = 0
+    legacy_failures = 0
+    totals = {"legacy": 0.0, "scanner": 0.0}
+    for case in cases:
+        parse = PARSERS[case["parser"]]
+        correct = parse(case) == case["expected"]
+        with mock.patch.object(parser, "_scan_json", _legacy_scan_json):
+            legacy_correct = parse(case) == case["expected"]
+        failures += not correct
+        legacy_failures += not legacy_correct
+        opening = OPENINGS[case["parser"]]
+        timings = {
+            "legacy": _time(lambda: _legacy_scan_json(case["output"], opening), args.iterations),
+            "scanner": _time(lambda: parser._scan_json(case["output"], opening), args.iterations),
+        }
+        for name, timing in timings.items():
+            totals[name] += timing
+        print(f"{case['name'][:43]:<44}{timings['legacy']:>14.3f}{timings['scanner']:>14.3f}{str(legacy_correct):>12}{str(correct):>12}")
+    print(
+        f"{'total':<44}{totals['legacy']:>14.3f}{totals['scanner']:>14.3f}"
+        f"{f'{len(cases) - legacy_failures}/{len(cases)}':>12}{f'{len(cases) - failures}/{len(cases)}':>12}"
+    )
+
+    print()
+    print(f"{'synthetic output':<32}{'size (kB)':>12}{'legacy (ms)':>14}{'scanner (ms)':>14}")
+    for size in args.sizes:
+        for name, (output, opening) in _synthetic_outputs(size).items():
+            # the legacy implementation is quadratic on some of these, so it is only timed once
+            legacy = _time(lambda: _legacy_scan_json(output, opening), 1)
+            scanner = _time(lambda: parser._scan_json(output, opening), max(args.iterations // 20, 1))
+            print(f"{name:<32}{len(output) / 1024:>12.1f}{legacy:>14.2f}{scanner:>14.2f}")
+
+    if failures:
+        raise SystemExit(f"{failures} output(s) were not parsed as expected")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Micro-benchmark of the image transcoding step of the captioning stage. Compares the in-memory Pillow
+path against the previous implementation, which wrote each image to `temp/` and converted it with an
+`ffmpeg` subprocess.
+
+Run from the `backend` directory (the usual `BEDROCK_*` environment variables must be set):
+    python -m benchmarks.transcode [--iterations 20]
+"""
+import argparse
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from typing import Callable
+
+from PIL import Image
+
+from app.services.tools.image_processing import _generate_base64_from_bytes
+
+
+def _sample_images() -> dict[str, bytes]:
+    """
+    Generate a set of images in the formats commonly found on venue pages.
+    """
+    image = Image.linear_gradient("L").resize((1200, 800)).convert("RGB")
+    samples = {}
+    for name, kwargs in {
+        "jpeg": {"format": "JPEG", "quality": 85},
+        "webp": {"format": "WEBP", "quality": 80},
+        "png": {"format": "PNG"},
+        "gif": {"format": "GIF"},
+    }.items():
+        buffer = io.BytesIO()
+        image.save(buffer, **kwargs)
+        samples[name] = buffer.getvalue()
+    return samples
+
+
+def _legacy_transcode(content: bytes, directory: str) -> bytes:
+    """
+    The previous implementation: write to disk, fork ffmpeg, read the output back and clean up.
+    """
+    file_name = os.path.join(directory, "image")
+    with open(file_name, "wb") as f:
+        f.write(content)
+    output_name = file_name + "-temp.png"
+    subprocess.check_call(["ffmpeg", "-y", "-loglevel", "error", "-i", file_name, output_name])
+    os.remove(file_name)
+    with open(output_name, "rb") as f:
+        output = f.read()
+    os.remove(output_name)
+    return output
+
+
+def _time(function: Callable[[bytes], object], content: bytes, iterations: int) -> float:
+    """
+    Return the mean time taken per call in milliseconds.
+    """
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function(content)
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    has_ffmpeg = shutil.which("ffmpeg") is not None
+    if not has_ffmpeg:
+        print("ffmpeg not found, skipping the legacy path")
+
+    print(f"{'format':<8}{'size (kB)':>12}{'in-memory (ms)':>18}{'ffmpeg + temp files (ms)':>28}")
+    with tempfile.TemporaryDirectory() as directory:
+        for name, content in _sample_images().items():
+            in_memory = _time(_generate_base64_from_bytes, content, args.iterations)
+            legacy = _time(lambda c: _legacy_transcode(c, directory), content, args.iterations) if has_ffmpeg else float("nan")
+            print(f"{name:<8}{len(content) / 1024:>12.1f}{in_memory:>18.2f}{legacy:>28.2f}")
+
+
+if __name__ == "__main__":
+    main()
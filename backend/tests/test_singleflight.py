@@ -0,0 +1,90 @@
+"""
+Run from the `backend` directory:
+    python -m unittest discover tests
+"""
+import asyncio
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from app.core.singleflight import SingleFlight
+
+EXECUTOR_THREADS = 4
+
+
+class SingleFlightAsyncTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=EXECUTOR_THREADS)
+        self.loop.set_default_executor(self.executor)
+
+    def tearDown(self):
+        self.loop.close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def test_more_waiters_than_executor_threads(self):
+        flight = SingleFlight("test")
+        executions = 0
+
+        async def function():
+            nonlocal executions
+            executions += 1
+            # the leader needs the default executor, like the scraper does
+            await asyncio.sleep(0.05)
+            return await asyncio.to_thread(lambda: "result")
+
+        async def main():
+            callers = [flight.do_async("key", function) for _ in range(EXECUTOR_THREADS + 2)]
+            return await asyncio.wait_for(asyncio.gather(*callers), timeout=5)
+
+        results = self.loop.run_until_complete(main())
+        self.assertEqual(results, ["result"] * (EXECUTOR_THREADS + 2))
+        self.assertEqual(executions, 1)
+        self.assertEqual(flight.stats().coalesced, EXECUTOR_THREADS + 1)
+
+    def test_cancelled_waiter(self):
+        flight = SingleFlight("test")
+        release = asyncio.Event()
+
+        async def function():
+            await release.wait()
+            return "result"
+
+        async def main():
+            leader = asyncio.create_task(flight.do_async("key", function))
+            await asyncio.sleep(0)
+            waiter = asyncio.create_task(flight.do_async("key", function))
+            other = asyncio.create_task(flight.do_async("key", function))
+            await asyncio.sleep(0)
+            waiter.cancel()
+            release.set()
+            return await asyncio.wait_for(asyncio.gather(leader, other), timeout=5), waiter.cancelled()
+
+        results, cancelled = self.loop.run_until_complete(main())
+        self.assertEqual(results, ["result", "result"])
+        self.assertTrue(cancelled)
+
+    def test_waiter_of_synchronous_call(self):
+        flight = SingleFlight("test")
+        started = threading.Event()
+
+        def function():
+            started.set()
+            time.sleep(0.05)
+            return "result"
+
+        thread = threading.Thread(target=flight.do, args=("key", function))
+        thread.start()
+        started.wait()
+
+        async def unused():
+            raise AssertionError("the call should have been shared")
+
+        result = self.loop.run_until_complete(asyncio.wait_for(flight.do_async("key", unused), timeout=5))
+        thread.join()
+        self.assertEqual(result, "result")
+
+
+if __name__ == "__main__":
+    unittest.main()